@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import shutil
+import stubs
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TESTS = {
+    "wrong-code-bug": ("wrong_code_bug.py", "kernel.cl"),
+    "ppcg": ("ppcg.py", "{}_kernel.cl".format(stubs.PPCG_HOST)),
+}
+
+VERDICTS = {0: "interesting", 1: "uninteresting", 255: "timeout", 254: "invalid"}
+
+KERNEL_HEADER = """// Seed: 42 -g 1,1,1 -l 1,1,1
+ulong get_linear_global_id(void)
+{
+    return (get_global_id(2) * get_global_size(1) + get_global_id(1)) * get_global_size(0) + get_global_id(0);
+}
+
+__kernel void entry(__global ulong *result)
+{
+"""
+
+KERNEL_FOOTER = """    result[get_linear_global_id()] = v0 ^ v1 ^ v2 ^ v3;
+}
+"""
+
+def get_seed_kernel(rng, statements):
+    lines = ["    ulong v{} = {};".format(i, rng.randrange(1 << 16)) for i in range(4)]
+
+    for _ in range(statements):
+        (a, b) = (rng.randrange(4), rng.randrange(4))
+        lines.append("    v{} = (v{} * {}) ^ {};".format(a, b, rng.randrange(3, 97, 2), rng.randrange(1 << 16)))
+
+    return lines
+
+def render(lines, indent="    "):
+    return KERNEL_HEADER + "".join(indent + line.lstrip() + "\n" for line in lines) + KERNEL_FOOTER
+
+# Mimics the line based passes of C-Reduce: chunks of decreasing size are
+# removed from the current test case. Some variants only change the
+# formatting and some have been tested before.
+class VariantStream:
+    def __init__(self, rng, statements, revisit_rate, reformat_rate):
+        self.rng = rng
+        self.lines = get_seed_kernel(rng, statements)
+        self.chunk = max(1, len(self.lines) // 2)
+        self.position = 0
+        self.history = []
+        self.revisit_rate = revisit_rate
+        self.reformat_rate = reformat_rate
+
+    def next(self):
+        if self.history and self.rng.random() < self.revisit_rate:
+            return self.rng.choice(self.history)
+
+        if self.rng.random() < self.reformat_rate:
+            return (render(self.lines, "\t"), self.lines)
+
+        if self.position >= len(self.lines):
+            self.position = 0
+            self.chunk = max(1, self.chunk // 2)
+
+        lines = self.lines[:self.position] + self.lines[self.position + self.chunk:]
+        self.position += self.chunk
+        variant = (render(lines), lines)
+        self.history.append(variant)
+
+        return variant
+
+    def accept(self, lines):
+        self.lines = lines
+        self.position = 0
+
+def run_check(script, test_case_name, content, env):
+    work_dir = tempfile.mkdtemp(prefix="bench.")
+
+    try:
+        with open(os.path.join(work_dir, test_case_name), "w") as test_file:
+            test_file.write(content)
+
+        start = time.monotonic()
+        proc = subprocess.Popen([sys.executable, script], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # The resource usage includes the tools run by the interestingness test
+        (_, status, usage) = os.wait4(proc.pid, 0)
+        latency = time.monotonic() - start
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return (proc.returncode, latency, usage.ru_maxrss * 1024)
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+def run_benchmark(test, args, bin_dir):
+    (script_name, test_case_name) = TESTS[test]
+    script = os.path.join(REPO_ROOT, "interestingness_tests", script_name)
+
+    env = os.environ.copy()
+    env["PATH"] = bin_dir + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = REPO_ROOT
+    env["CREDUCE_TEST_CLANG"] = os.path.join(bin_dir, "clang")
+    env["CREDUCE_TEST_CL_LAUNCHER"] = "cl_launcher"
+    env["CREDUCE_PPCG_HOST_EXEC_DIR"] = bin_dir
+    env["CREDUCE_TEST_CASE"] = test_case_name
+    env["NUMDIFF"] = os.path.join(bin_dir, "numdiff")
+    env.setdefault("CREDUCE_TEST_PLATFORM", "0")
+    env.setdefault("CREDUCE_TEST_DEVICE", "0")
+    env.setdefault("CREDUCE_TEST_TIMEOUT", str(args.timeout))
+    env.setdefault("CREDUCE_TEST_STATIC", "1")
+
+    stream = VariantStream(random.Random(args.seed), args.statements, args.revisit_rate, args.reformat_rate)
+    verdicts = collections.Counter()
+    latencies = []
+    peak_rss = 0
+
+    start = time.monotonic()
+
+    # Like C-Reduce the variants are checked in batches of parallel tests and
+    # the first interesting variant of a batch is kept
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        while len(latencies) < args.checks:
+            batch = [stream.next() for _ in range(min(args.jobs, args.checks - len(latencies)))]
+            futures = [executor.submit(run_check, script, test_case_name, content, env) for (content, _) in batch]
+            accepted = None
+
+            for ((_, lines), future) in zip(batch, futures):
+                (returncode, latency, rss) = future.result()
+                verdicts[VERDICTS.get(returncode, "error")] += 1
+                latencies.append(latency)
+                peak_rss = max(peak_rss, rss)
+
+                if returncode == 0 and accepted is None:
+                    accepted = lines
+
+            if accepted is not None:
+                stream.accept(accepted)
+
+    elapsed = time.monotonic() - start
+
+    return {
+        "test": test,
+        "checks": len(latencies),
+        "seconds": elapsed,
+        "checks_per_second": len(latencies) / elapsed,
+        "p50": get_percentile(latencies, 50),
+        "p99": get_percentile(latencies, 99),
+        "peak_rss": peak_rss,
+        "verdicts": dict(verdicts),
+    }
+
+def print_result(result):
+    print("{}: {} checks in {:.1f} s, {:.2f} checks/s, p50 {:.3f} s, p99 {:.3f} s, peak RSS {:.1f} MiB".format(
+        result["test"], result["checks"], result["seconds"], result["checks_per_second"], result["p50"], result["p99"], result["peak_rss"] / (1 << 20)))
+    print("  " + ", ".join("{} {}".format(v, c) for (v, c) in sorted(result["verdicts"].items())))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the throughput of the interestingness tests with a stub toolchain.")
+    parser.add_argument("--test", choices=sorted(TESTS) + ["all"], default="all", help="Interestingness test that should be measured")
+    parser.add_argument("--checks", type=int, default=200, help="Number of checks per interestingness test")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="Number of parallel checks (like C-Reduce's -n)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the variant stream")
+    parser.add_argument("--statements", type=int, default=64, help="Number of statements of the seed kernel")
+    parser.add_argument("--revisit-rate", dest="revisit_rate", type=float, default=0.1, help="Fraction of variants which have been checked before")
+    parser.add_argument("--reformat-rate", dest="reformat_rate", type=float, default=0.05, help="Fraction of variants which only change the formatting")
+    parser.add_argument("--profile", help="JSON file with per tool overrides of the stub behaviour (see benchmarks/stubs.py)")
+    parser.add_argument("--latency-scale", dest="latency_scale", type=float, default=1.0, help="Factor for all stub latencies, 0 measures the overhead of the tests only")
+    parser.add_argument("--timeout", type=int, default=10, help="CREDUCE_TEST_TIMEOUT unless set in the environment")
+    parser.add_argument("--json", help="Write the results to this file")
+
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        print("The benchmarks require a POSIX system!")
+        sys.exit(1)
+
+    overrides = None
+
+    if args.profile is not None:
+        with open(args.profile, "r") as profile_file:
+            overrides = json.load(profile_file)
+
+    bin_dir = tempfile.mkdtemp(prefix="bench-bin.")
+
+    try:
+        stubs.write_stubs(bin_dir, stubs.get_profile(overrides, args.latency_scale))
+        tests = sorted(TESTS) if args.test == "all" else [args.test]
+        results = []
+
+        for test in tests:
+            result = run_benchmark(test, args, bin_dir)
+            print_result(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(bin_dir, ignore_errors=True)
+
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
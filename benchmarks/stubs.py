@@ -0,0 +1,199 @@
+import copy
+import json
+import os
+import sys
+
+# Behaviour of the stub tools. Latencies are in seconds, sizes in characters and
+# rates are the fractions of the test cases for which the event happens.
+DEFAULT_PROFILE = {
+    "clang": {"latency": 0.02, "jitter": 0.5, "output_size": 20000, "failure_rate": 0.0, "reject_rate": 0.05},
+    "clang_analyzer": {"latency": 0.05, "jitter": 0.5, "output_size": 0, "failure_rate": 0.0, "reject_rate": 0.05},
+    "oclgrind": {"latency": 0.2, "uninstrumented_latency": 0.05, "jitter": 0.5, "failure_rate": 0.05, "reject_rate": 0.1},
+    "cl_launcher": {"latency": 0.05, "jitter": 0.5, "output_size": 4000, "failure_rate": 0.02, "interesting_rate": 0.3},
+    "ppcg_host": {"latency": 0.05, "jitter": 0.5, "output_size": 20000, "failure_rate": 0.02, "interesting_rate": 0.3},
+    "numdiff": {"latency": 0.005, "jitter": 0.0},
+}
+
+# Name of the PPCG host program, the kernel is <name>_kernel.cl
+PPCG_HOST = "bench"
+
+STUB_SOURCE = r'''
+import hashlib
+import json
+import os
+import sys
+import time
+
+with open(PROFILE_PATH, "r") as profile_file:
+    PROFILE = json.load(profile_file)
+
+# Decisions only depend on the test case so that every check of a variant has
+# the same outcome
+def draw(tool, event, content):
+    digest = hashlib.sha256("{}:{}:".format(tool, event).encode() + content).digest()
+
+    return int.from_bytes(digest[:4], "little") / 2 ** 32
+
+def pause(tool, content, latency=None):
+    settings = PROFILE[tool]
+
+    if latency is None:
+        latency = settings.get("latency", 0.0)
+
+    jitter = settings.get("jitter", 0.0)
+    time.sleep(max(0.0, latency * (1.0 + jitter * (2.0 * draw(tool, "jitter", content) - 1.0))))
+
+def happens(tool, event, content):
+    return draw(tool, event, content) < PROFILE[tool].get(event + "_rate", 0.0)
+
+def read_kernel(path):
+    with open(path, "rb") as kernel_file:
+        return kernel_file.read()
+
+def get_values(size):
+    count = max(1, size // 4)
+
+    return [(i * 7919) % 1000 for i in range(count)]
+
+def get_result(tool, content, size, differs):
+    values = get_values(size)
+
+    # A wrong-code bug changes one value somewhere in the output
+    if differs:
+        values[int(draw(tool, "position", content) * len(values))] += 1
+
+    return ",".join(str(v) for v in values) + ",\n"
+
+def get_array_dump(tool, content, size, differs):
+    values = [v / 8 for v in get_values(size // 2)]
+
+    if differs:
+        values[int(draw(tool, "position", content) * len(values))] += 1.0
+
+    lines = ["==BEGIN DUMP_ARRAYS=="]
+    lines.extend("A {}".format(" ".join(str(v) for v in values[i:i + 16])) for i in range(0, len(values), 16))
+    lines.append("==END DUMP_ARRAYS==")
+
+    return "\n".join(lines) + "\n"
+
+def get_option(args, name):
+    return args[args.index(name) + 1] if name in args else None
+
+def clang(args):
+    content = read_kernel(args[-1])
+
+    if "--analyze" in args:
+        pause("clang_analyzer", content)
+
+        if happens("clang_analyzer", "failure", content):
+            sys.exit(1)
+
+        if happens("clang_analyzer", "reject", content):
+            print("kernel.cl:1:1: warning: Dereference of null pointer", file=sys.stderr)
+
+        return
+
+    pause("clang", content)
+
+    if happens("clang", "failure", content):
+        print("kernel.cl:1:1: error: expected expression", file=sys.stderr)
+        sys.exit(1)
+
+    if "-ast-dump" in args:
+        sys.stdout.write("TranslationUnitDecl\n" + "|-FunctionDecl <line:1:1> entry 'void (void)'\n" * (PROFILE["clang"]["output_size"] // 48))
+
+        if happens("clang", "reject", content):
+            print("| `-ImplicitCastExpr <PointerToIntegral>")
+
+def cl_launcher(args):
+    content = read_kernel(get_option(args, "-f"))
+    pause("cl_launcher", content)
+
+    if happens("cl_launcher", "failure", content):
+        print("Error: clBuildProgram failed", file=sys.stderr)
+        sys.exit(1)
+
+    sys.stdout.write(get_result("cl_launcher", content, PROFILE["cl_launcher"]["output_size"], happens("cl_launcher", "interesting", content)))
+
+def ppcg_host(args):
+    content = read_kernel(os.path.basename(sys.argv[0]) + "_kernel.cl")
+    pause("ppcg_host", content)
+
+    if happens("ppcg_host", "failure", content):
+        sys.exit(1)
+
+    print("ok")
+    sys.stderr.write(get_array_dump("ppcg_host", content, PROFILE["ppcg_host"]["output_size"], happens("ppcg_host", "interesting", content)))
+
+def oclgrind(args):
+    instrumented = "--data-races" in args
+    i = 0
+
+    # Skip the options of Oclgrind, only --stop-errors takes a value
+    while args[i].startswith("-"):
+        i += 2 if args[i] == "--stop-errors" else 1
+
+    program = args[i]
+
+    if os.path.basename(program) == "cl_launcher":
+        content = read_kernel(get_option(args, "-f"))
+    else:
+        content = read_kernel(os.path.basename(program) + "_kernel.cl")
+
+    settings = PROFILE["oclgrind"]
+    pause("oclgrind", content, settings["latency"] if instrumented else settings.get("uninstrumented_latency", settings["latency"]))
+
+    if happens("oclgrind", "failure", content) or instrumented and happens("oclgrind", "reject", content):
+        print("Oclgrind - Data race detected", file=sys.stderr)
+        sys.exit(1)
+
+    if os.path.basename(program) == "cl_launcher":
+        sys.stdout.write(get_result("oclgrind", content, PROFILE["cl_launcher"]["output_size"], False))
+    else:
+        print("ok")
+        sys.stderr.write(get_array_dump("oclgrind", content, PROFILE["ppcg_host"]["output_size"], False))
+
+def numdiff(args):
+    files = [a for a in args if not a.startswith("-")]
+
+    with open(files[0], "rb") as first, open(files[1], "rb") as second:
+        content = first.read()
+        different = content != second.read()
+
+    pause("numdiff", content)
+    sys.exit(1 if different else 0)
+'''
+
+def get_profile(overrides=None, latency_scale=1.0):
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+
+    for (tool, settings) in (overrides or {}).items():
+        profile.setdefault(tool, {}).update(settings)
+
+    for settings in profile.values():
+        for key in ("latency", "uninstrumented_latency"):
+            if key in settings:
+                settings[key] *= latency_scale
+
+    return profile
+
+def write_stub(path, profile_path, function):
+    with open(path, "w") as stub_file:
+        # Without site packages the stubs start as fast as possible
+        stub_file.write("#!{} -S\n".format(sys.executable))
+        stub_file.write("PROFILE_PATH = {!r}\n".format(profile_path))
+        stub_file.write(STUB_SOURCE)
+        stub_file.write("\n{}(sys.argv[1:])\n".format(function))
+
+    os.chmod(path, 0o755)
+
+# Creates the stub tools in bin_dir, which has to be prepended to PATH
+def write_stubs(bin_dir, profile):
+    os.makedirs(bin_dir, exist_ok=True)
+    profile_path = os.path.join(os.path.abspath(bin_dir), "profile.json")
+
+    with open(profile_path, "w") as profile_file:
+        json.dump(profile, profile_file, indent=2, sort_keys=True)
+
+    for (name, function) in [("clang", "clang"), ("cl_launcher", "cl_launcher"), ("oclgrind", "oclgrind"), ("numdiff", "numdiff"), (PPCG_HOST, "ppcg_host")]:
+        write_stub(os.path.join(bin_dir, name), profile_path, function)
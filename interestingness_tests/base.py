@@ -1,5 +1,14 @@
 import sys
 import enum
+import os
+import signal
+import time
+from interestingness_tests import cache
+from interestingness_tests import execution
+from interestingness_tests import replay
+from interestingness_tests import stages
+from interestingness_tests import timeouts
+from interestingness_tests import trace
 
 class InvalidTestCaseError(Exception):
     pass
@@ -8,26 +17,299 @@ class TestTimeoutError(Exception):
     pass
 
 class InterestingnessTest:
+    # Options which do not influence the verdict of a test case
+    uncached_options = ("cache", "stage_statistics", "capture_limit", "trace", "record", "replay", "replay_timing")
+
     @classmethod
     def get_test_options(cls, env):
-        return dict()
+        options = dict()
+
+        options["cache"] = env.get("CREDUCE_TEST_CACHE")
+        options["adaptive_timeout"] = env.get("CREDUCE_TEST_ADAPTIVE_TIMEOUT")
+        options["adaptive_timeout_factor"] = env.get("CREDUCE_TEST_ADAPTIVE_TIMEOUT_FACTOR")
+        options["adaptive_timeout_floor"] = env.get("CREDUCE_TEST_ADAPTIVE_TIMEOUT_FLOOR")
+        options["stage_statistics"] = env.get("CREDUCE_TEST_STAGE_STATS")
+        options["capture_limit"] = env.get("CREDUCE_TEST_CAPTURE_LIMIT")
+        options["trace"] = env.get("CREDUCE_TEST_TRACE")
+        options["record"] = env.get("CREDUCE_TEST_RECORD")
+        options["replay"] = env.get("CREDUCE_TEST_REPLAY")
+        options["replay_timing"] = env.get("CREDUCE_TEST_REPLAY_TIMING")
+
+        return options
 
     def __init__(self, test_cases, options):
         self.test_cases = test_cases
         self.options = options
 
+        if "cache" in self.options and self.options["cache"] is not None:
+            self.cache = cache.VerdictCache(str(self.options["cache"]))
+        else:
+            self.cache = None
+
+        if "adaptive_timeout" in self.options and self.options["adaptive_timeout"] is not None:
+            factor = self.options.get("adaptive_timeout_factor")
+            floor = self.options.get("adaptive_timeout_floor")
+            self.adaptive_timeouts = timeouts.AdaptiveTimeouts(str(self.options["adaptive_timeout"]),
+                                                               float(factor) if factor is not None else 5.0,
+                                                               float(floor) if floor is not None else 5.0)
+        else:
+            self.adaptive_timeouts = None
+
+        self.tool_runs = []
+
+        if "capture_limit" in self.options and self.options["capture_limit"] is not None:
+            self.capture_limit = int(self.options["capture_limit"])
+        else:
+            self.capture_limit = execution.DEFAULT_CAPTURE_LIMIT
+
+        if "stage_statistics" in self.options and self.options["stage_statistics"] is not None:
+            self.stage_statistics = stages.StageStatistics(str(self.options["stage_statistics"]))
+        else:
+            self.stage_statistics = None
+
+        if "trace" in self.options and self.options["trace"] is not None:
+            self.tracer = trace.Tracer(str(self.options["trace"]))
+        else:
+            self.tracer = None
+
+        if "record" in self.options and self.options["record"] is not None:
+            self.recorder = replay.Recordings(str(self.options["record"]))
+        else:
+            self.recorder = None
+
+        if "replay" in self.options and self.options["replay"] is not None:
+            self.replayer = replay.Recordings(str(self.options["replay"]))
+        else:
+            self.replayer = None
+
+        if "replay_timing" in self.options and self.options["replay_timing"] is not None:
+            if self.options["replay_timing"] not in ("original", "instant"):
+                print("Invalid replay timing!")
+                sys.exit(1)
+
+            self.replay_instant = (self.options["replay_timing"] == "instant")
+        else:
+            self.replay_instant = False
+
+    def get_tools(self):
+        return []
+
+    def prepare(self):
+        # Hook to set up state which can be shared by many checks, e.g. in the
+        # interestingness test daemon
+        pass
+
+    # Reuses the instance, including the state set up by prepare(), to check
+    # other test cases
+    def set_test_cases(self, test_cases):
+        self.test_cases = test_cases
+
+        # Other checks might have recorded the baselines in the meantime
+        if self.adaptive_timeouts is not None:
+            self.adaptive_timeouts.reload()
+
+    # All tools are started through this method, timeout is the upper bound
+    # for the runtime of the tool
+    def _start_tool(self, group, name, cmd, timeout, env=None, expected_stdout=None):
+        if self.adaptive_timeouts is not None:
+            timeout = self.adaptive_timeouts.get_timeout(name, timeout)
+
+        if self.recorder is not None or self.replayer is not None:
+            key = replay.get_key(name, cmd, self.test_cases)
+        else:
+            key = None
+
+        if self.replayer is not None:
+            # Runs without a recording fail once their result is needed
+            recording = self.replayer.lookup(key)
+            run = group.replay(name, cmd, timeout, recording, self.replay_instant, expected_stdout, self.capture_limit)
+        else:
+            run = group.start(name, cmd, timeout, env, expected_stdout, self.capture_limit)
+
+        run.recording_key = key
+        self.tool_runs.append(run)
+
+        return run
+
+    def _run_tool(self, name, cmd, timeout, env=None):
+        with execution.ToolRunGroup() as group:
+            return self._start_tool(group, name, cmd, timeout, env).result()
+
+    def _record_tool_runs(self):
+        if self.adaptive_timeouts is not None:
+            for run in self.tool_runs:
+                if run.runtime is not None and not run.cancelled:
+                    self.adaptive_timeouts.record(run.name, run.runtime)
+
+            self.adaptive_timeouts.save()
+
+        if self.recorder is not None:
+            for run in self.tool_runs:
+                self._record_tool_run(run)
+
+        if self.tracer is not None:
+            for run in self.tool_runs:
+                returncode = run.completed.returncode if run.completed is not None else None
+                end = run.end_time if run.end_time is not None else time.monotonic()
+                self.tracer.add_span("tool", run.name, run.start_time, end,
+                                     returncode=returncode,
+                                     timed_out=run.timed_out,
+                                     cancelled=run.cancelled,
+                                     diverged=run.diverged,
+                                     stdout_size=run.stdout.size,
+                                     stderr_size=run.stderr.size)
+
+        self.tool_runs = []
+
+    def _record_tool_run(self, run):
+        # Cancelled runs have not produced their complete output
+        if run.cancelled:
+            return
+
+        if run.diverged:
+            recording = {"returncode": None, "stdout": str(run.stdout), "stderr": "", "timed_out": False, "diverged": True,
+                         "duration": run.end_time - run.start_time}
+        elif run.timed_out:
+            recording = {"returncode": None, "stdout": "", "stderr": "", "timed_out": True,
+                         "duration": run.end_time - run.start_time}
+        elif run.completed is not None:
+            recording = {"returncode": run.completed.returncode, "stdout": str(run.stdout), "stderr": str(run.stderr), "timed_out": False,
+                         "duration": run.runtime}
+        else:
+            return
+
+        recording["name"] = run.name
+        recording["cmd"] = run.cmd
+        self.recorder.store(run.recording_key, recording)
+
+    # Runs the stages of a check and returns the output of the last one, which
+    # has to be the verdict. A rejection by StageRejection means not interesting.
+    def run_stages(self, check_stages):
+        if self.stage_statistics is not None:
+            check_stages = stages.order_stages(check_stages, self.stage_statistics.lookup(type(self).__name__))
+
+        results = dict()
+        records = []
+
+        try:
+            for stage in check_stages:
+                start = time.monotonic()
+
+                try:
+                    results[stage.name] = stage.run(results)
+                except (stages.StageRejection, InvalidTestCaseError, TestTimeoutError) as err:
+                    end = time.monotonic()
+                    records.append((stage.name, True, end - start))
+
+                    if self.tracer is not None:
+                        self.tracer.add_span("stage", stage.name, start, end, rejected=True,
+                                             rejection=type(err).__name__, reason=str(err) or None)
+
+                    raise
+
+                end = time.monotonic()
+                records.append((stage.name, False, end - start))
+
+                # The last stage rejects a variant by returning False
+                if self.tracer is not None:
+                    self.tracer.add_span("stage", stage.name, start, end, rejected=(results[stage.name] is False))
+        except stages.StageRejection:
+            return False
+        finally:
+            if self.stage_statistics is not None:
+                self.stage_statistics.store(type(self).__name__, records)
+
+        return results[check_stages[-1].name]
+
     def check(self):
         raise NotImplementedError("Please use a custom interestingness test class!")
 
-    def run(self):
+    def _check(self):
+        if self.tracer is not None:
+            self.tracer.begin(self.test_cases)
+
+        verdict = "error"
+        reason = None
+
         try:
             result = self.check()
+            verdict = "interesting" if result else "uninteresting"
+            return result
+        except TestTimeoutError as err:
+            (verdict, reason) = ("timeout", str(err))
+            raise
+        except InvalidTestCaseError as err:
+            (verdict, reason) = ("invalid", str(err))
+            raise
+        finally:
+            self._record_tool_runs()
+
+            if self.tracer is not None:
+                self.tracer.end(verdict, reason)
+
+    def _trace_cached_verdict(self, verdict, reason):
+        if self.tracer is not None:
+            self.tracer.begin(self.test_cases)
+            self.tracer.end(verdict, reason, cached=True)
+
+    def check_cached(self):
+        if self.cache is None:
+            return self._check()
+
+        options = {k: v for (k, v) in self.options.items() if k not in self.uncached_options}
+        key = self.cache.get_key(self.test_cases, options, self.get_tools())
+        entry = self.cache.lookup(key)
+
+        if entry is not None:
+            (verdict, reason) = entry
+            self._trace_cached_verdict(verdict, reason)
+
+            if verdict == cache.VerdictCache.timeout:
+                raise TestTimeoutError(reason)
+            elif verdict == cache.VerdictCache.invalid:
+                raise InvalidTestCaseError(reason)
+            else:
+                return verdict == cache.VerdictCache.interesting
+
+        try:
+            result = self._check()
+        except TestTimeoutError as err:
+            self.cache.store(key, cache.VerdictCache.timeout, str(err))
+            raise
+        except InvalidTestCaseError as err:
+            self.cache.store(key, cache.VerdictCache.invalid, str(err))
+            raise
+
+        if result:
+            self.cache.store(key, cache.VerdictCache.interesting)
+        else:
+            self.cache.store(key, cache.VerdictCache.uninteresting)
+
+        return result
+
+    def get_exit_status(self):
+        try:
+            result = self.check_cached()
         except TestTimeoutError:
-            sys.exit(-1)
+            return -1
         except InvalidTestCaseError:
-            sys.exit(-2)
+            return -2
 
         if result:
-            sys.exit(0)
+            return 0
         else:
-            sys.exit(1)
+            return 1
+
+    @staticmethod
+    def _terminate(signum, frame):
+        # C-Reduce terminates tests whose result is not needed anymore, their
+        # tools would keep the device busy otherwise
+        execution.kill_live_runs()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._terminate)
+
+        sys.exit(self.get_exit_status())
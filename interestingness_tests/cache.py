@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+
+def connect(path):
+    # Several interestingness tests share the database when C-Reduce runs
+    # them in parallel
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    return connection
+
+def get_tool_identity(tool):
+    path = shutil.which(tool)
+
+    if path is None:
+        return tool
+
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+
+    return "{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+class VerdictCache:
+    interesting = "interesting"
+    uninteresting = "uninteresting"
+    timeout = "timeout"
+    invalid = "invalid"
+
+    def __init__(self, path):
+        self.connection = connect(path)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict TEXT NOT NULL, reason TEXT)")
+
+    def get_key(self, test_cases, options, tools):
+        digest = hashlib.sha256()
+
+        for test_case in test_cases:
+            digest.update(os.path.basename(test_case).encode())
+
+            with open(test_case, "rb") as test_file:
+                digest.update(test_file.read())
+
+        digest.update(json.dumps(options, sort_keys=True).encode())
+
+        for tool in tools:
+            digest.update(get_tool_identity(tool).encode())
+
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        row = self.connection.execute("SELECT verdict, reason FROM verdicts WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return (row[0], row[1])
+
+    def store(self, key, verdict, reason=None):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO verdicts (key, verdict, reason) VALUES (?, ?, ?)", (key, verdict, reason))
+
+class ResultCache:
+    def __init__(self, path):
+        self.connection = connect(path)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get_key(self, kind, digest, tools):
+        key = hashlib.sha256()
+        key.update(kind.encode())
+        key.update(digest.encode())
+
+        for tool in tools:
+            key.update(get_tool_identity(tool).encode())
+
+        return key.hexdigest()
+
+    def lookup(self, key):
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def store(self, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, json.dumps(value)))
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Thin client for the interestingness test daemon. It only uses the standard
+# library to keep the startup time for every check low.
+import json
+import os
+import socket
+import sys
+
+if __name__ == "__main__":
+    socket_path = os.environ.get("CREDUCE_TEST_DAEMON_SOCKET")
+
+    if len(sys.argv) > 1:
+        test_case = sys.argv[1]
+    else:
+        test_case = os.environ.get("CREDUCE_TEST_CASE")
+
+    if socket_path is None or test_case is None:
+        print("Missing daemon socket or test case!")
+        sys.exit(1)
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    client.sendall((json.dumps({"cwd": os.getcwd(), "test_case": test_case}) + "\n").encode())
+
+    with client.makefile("rb") as response_file:
+        response = response_file.readline()
+
+    client.close()
+
+    if not response:
+        sys.exit(1)
+
+    sys.exit(json.loads(response.decode())["status"])
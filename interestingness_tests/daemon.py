@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import argparse
+import interestingness_tests
+import interestingness_tests.base
+import interestingness_tests.execution
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import traceback
+
+tests = {
+    "wrong-code-bug": interestingness_tests.WrongCodeBugOpenCLInterestingnessTest,
+    "ppcg": interestingness_tests.PPCGInterestingnessTest,
+}
+
+class CheckRequestHandler(socketserver.StreamRequestHandler):
+    def _watch_client(self):
+        # The client does not send anything after its request, end of file
+        # means that C-Reduce has killed it because the result is not needed
+        # anymore
+        try:
+            data = self.request.recv(1)
+        except OSError:
+            data = b""
+
+        if not data and not self.replied:
+            # The tools run in their own sessions and would keep running. The
+            # check is abandoned before the killed tools can influence its
+            # verdict, e.g. in the cache.
+            interestingness_tests.execution.kill_live_runs()
+            os._exit(1)
+
+    def handle(self):
+        # The daemon terminates the running checks when it is stopped
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, interestingness_tests.base.InterestingnessTest._terminate)
+
+        request = json.loads(self.rfile.readline().decode())
+
+        self.replied = False
+        watcher = threading.Thread(target=self._watch_client)
+        watcher.daemon = True
+        watcher.start()
+
+        # Runs in a forked child so that the working directory can be changed
+        os.chdir(request["cwd"])
+        test_case = request["test_case"]
+
+        if not os.path.isfile(test_case) or not os.access(test_case, os.F_OK):
+            status = 1
+        else:
+            try:
+                # The changes to the prepared instance are lost with the child
+                test = self.server.test
+                test.set_test_cases([test_case])
+                status = test.get_exit_status()
+            except Exception:
+                traceback.print_exc()
+                status = 1
+
+        self.replied = True
+        self.wfile.write((json.dumps({"status": status}) + "\n").encode())
+
+class InterestingnessTestServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, socket_path, test_class, options):
+        super().__init__(socket_path, CheckRequestHandler)
+
+        # Warm up everything that can be shared by the forked checks, e.g. the
+        # PCH and the connections to the caches. The daemon itself does not
+        # use the connections once it has started to fork.
+        self.test = test_class([], options)
+        self.test.prepare()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daemon which serves interestingness checks over a Unix socket.")
+    parser.add_argument("--test", required=True, choices=sorted(tests.keys()), help="Interestingness test that should be used")
+    parser.add_argument("--socket", required=True, help="Path of the Unix socket")
+
+    args = parser.parse_args()
+
+    test_class = tests[args.test]
+    options = test_class.get_test_options(os.environ)
+
+    server = InterestingnessTestServer(args.socket, test_class, options)
+
+    # Clean up the socket when the reduction is finished
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    finally:
+        # Checks which are still running are abandoned, the forked children
+        # kill their tools. Otherwise closing the server would wait for them.
+        for pid in list(server.active_children or ()):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        server.server_close()
+
+        try:
+            os.remove(args.socket)
+        except OSError:
+            pass
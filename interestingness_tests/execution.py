@@ -0,0 +1,396 @@
+from interestingness_tests import base
+import codecs
+import hashlib
+import io
+import locale
+import os
+import queue
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+# Output beyond this number of characters is spilled to a temporary file
+DEFAULT_CAPTURE_LIMIT = 1 << 20
+
+# Tools run in their own sessions and are not killed together with the test,
+# all runs with a live process are tracked to kill them when the test ends
+_live_runs = set()
+_live_runs_lock = threading.Lock()
+
+def kill_live_runs():
+    with _live_runs_lock:
+        runs = list(_live_runs)
+
+    for run in runs:
+        run._kill()
+
+# Captured output of a tool. Only the first limit characters are kept in
+# memory, the digest and the tail are maintained while the output is written.
+class Output:
+    tail_size = 4096
+
+    def __init__(self, limit=DEFAULT_CAPTURE_LIMIT):
+        self.limit = limit
+        self.size = 0
+        self.tail = ""
+        self._chunks = []
+        self._text = None
+        self._file = None
+        self._digest = hashlib.sha256()
+
+    def write(self, text):
+        self._digest.update(text.encode())
+        self.size += len(text)
+        self.tail = (self.tail + text)[-self.tail_size:]
+
+        if self._file is None and self.size > self.limit:
+            self._file = tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="")
+            self._file.write("".join(self._chunks))
+            self._chunks = []
+
+        if self._file is not None:
+            self._file.write(text)
+        else:
+            self._chunks.append(text)
+
+    def close(self):
+        if self._file is None:
+            self._text = "".join(self._chunks)
+            self._chunks = []
+
+    def spilled(self):
+        return self._file is not None
+
+    def chunks(self, chunk_size=1 << 20):
+        if self._file is None:
+            yield self._text if self._text is not None else "".join(self._chunks)
+            return
+
+        self._file.flush()
+        self._file.seek(0)
+
+        while True:
+            chunk = self._file.read(chunk_size)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+    def lines(self):
+        # Lines which span several chunks are joined
+        rest = ""
+
+        for chunk in self.chunks():
+            lines = (rest + chunk).split("\n")
+            rest = lines.pop()
+
+            for line in lines:
+                yield line + "\n"
+
+        if rest:
+            yield rest
+
+    def text(self):
+        return "".join(self.chunks())
+
+    def digest(self):
+        return self._digest.hexdigest()
+
+    def __str__(self):
+        return self.text()
+
+    def __contains__(self, substring):
+        # Keep enough of the previous chunk to find matches across chunks
+        overlap = ""
+
+        for chunk in self.chunks():
+            window = overlap + chunk
+
+            if substring in window:
+                return True
+
+            overlap = window[len(window) - len(substring) + 1:] if len(substring) > 1 else ""
+
+        return False
+
+    def __eq__(self, other):
+        if isinstance(other, Output):
+            return self.size == other.size and self.digest() == other.digest()
+        elif isinstance(other, str):
+            if self.size != len(other):
+                return False
+
+            if self._file is None:
+                return self.text() == other
+
+            return self.digest() == hashlib.sha256(other.encode()).hexdigest()
+
+        return NotImplemented
+
+    __hash__ = None
+
+class ToolRun:
+    def __init__(self, name, cmd, timeout, env=None, finished=None, expected_stdout=None, capture_limit=DEFAULT_CAPTURE_LIMIT):
+        self.name = name
+        self.cmd = cmd
+        self.timeout = timeout
+        self.proc = None
+        self.completed = None
+        self.timed_out = False
+        self.cancelled = False
+        # The run is killed as soon as its output differs from expected_stdout
+        self.expected_stdout = expected_stdout
+        self.diverged = False
+        self.runtime = None
+        self.stdout = Output(capture_limit)
+        self.stderr = Output(capture_limit)
+        self._finished = finished
+        self._done = threading.Event()
+
+        self.start_time = time.monotonic()
+        self.end_time = None
+        # Identifies the invocation if runs are recorded or replayed
+        self.recording_key = None
+        # Replayed runs without a recording never finish
+        self.missing = False
+
+        self._start(env)
+
+    def _start(self, env):
+        try:
+            # Tools run in their own process group so that their children can be
+            # killed as well, e.g. the program started by Oclgrind
+            self.proc = subprocess.Popen(self.cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         start_new_session=(os.name == "posix"))
+        except subprocess.SubprocessError:
+            self._set_done()
+            return
+
+        with _live_runs_lock:
+            _live_runs.add(self)
+
+        thread = threading.Thread(target=self._wait)
+        thread.daemon = True
+        thread.start()
+
+    def _set_done(self):
+        self.end_time = time.monotonic()
+        self._done.set()
+
+        if self._finished is not None:
+            self._finished.put(self)
+
+    def _time_out(self):
+        self.timed_out = True
+        self._kill()
+
+    def _read(self, stream, output, expected=None):
+        # Same decoding as for universal_newlines
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+        decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+
+        while True:
+            data = os.read(stream.fileno(), 65536)
+            text = decoder.decode(data, final=(not data))
+
+            if text:
+                if expected is not None and text != expected[output.size:output.size + len(text)]:
+                    self.diverged = True
+                    self._kill()
+
+                output.write(text)
+
+            if not data or self.diverged:
+                break
+
+        output.close()
+
+    def _wait(self):
+        stderr_thread = threading.Thread(target=self._read, args=(self.proc.stderr, self.stderr))
+        stderr_thread.daemon = True
+        stderr_thread.start()
+
+        timer = threading.Timer(self.timeout, self._time_out) if self.timeout is not None else None
+
+        if timer is not None:
+            timer.start()
+
+        self._read(self.proc.stdout, self.stdout, self.expected_stdout)
+
+        if timer is not None:
+            timer.cancel()
+
+        self.proc.wait()
+
+        with _live_runs_lock:
+            _live_runs.discard(self)
+
+        self.proc.stdout.close()
+        stderr_thread.join()
+        self.proc.stderr.close()
+
+        if self.diverged:
+            self.timed_out = False
+
+        if not self.timed_out:
+            self.completed = subprocess.CompletedProcess(self.cmd, self.proc.returncode, self.stdout, self.stderr)
+
+            # Killed runs say nothing about the runtime of the tool
+            if not self.diverged:
+                self.runtime = time.monotonic() - self.start_time
+
+        self._set_done()
+
+    def _kill(self):
+        try:
+            if os.name == "posix":
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except ProcessLookupError:
+            pass
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        self.cancelled = True
+
+        if self.proc is not None and self.proc.poll() is None:
+            self._kill()
+
+    def result(self):
+        self._done.wait()
+
+        if self.cancelled:
+            return None
+
+        if self.timed_out:
+            raise base.TestTimeoutError(self.name)
+
+        return self.completed
+
+# Plays back a recorded run of a tool instead of starting it. The run finishes
+# after the recorded duration unless it is replayed instantly.
+class ReplayedRun(ToolRun):
+    def __init__(self, name, cmd, timeout, recording, instant=False, finished=None, expected_stdout=None, capture_limit=DEFAULT_CAPTURE_LIMIT):
+        self.recording = recording
+        self.instant = instant
+        self._timer = None
+        self._lock = threading.Lock()
+
+        super().__init__(name, cmd, timeout, None, finished, expected_stdout, capture_limit)
+
+    def _start(self, env):
+        if self.recording is None:
+            self.missing = True
+            return
+
+        duration = self.recording["duration"]
+        timed_out = self.recording["timed_out"]
+        stdout = self.recording["stdout"]
+
+        # Only the beginning of the output has been recorded if the run was
+        # killed, which is enough if it diverges again
+        if self.recording.get("diverged") and (self.expected_stdout is None or stdout == self.expected_stdout[:len(stdout)]):
+            self.missing = True
+            return
+
+        # The timeout might be lower than during the recording
+        if self.timeout is not None and duration > self.timeout:
+            (duration, timed_out) = (self.timeout, True)
+
+        # The real run would have been killed at the first difference
+        if not timed_out and self.expected_stdout is not None and stdout != self.expected_stdout:
+            prefix = len(os.path.commonprefix([stdout, self.expected_stdout]))
+            duration *= min(1.0, (prefix + 1) / max(1, len(stdout)))
+            stdout = stdout[:prefix + 1]
+            self.diverged = True
+
+        if self.instant:
+            self._finish(duration, timed_out, stdout)
+        else:
+            self._timer = threading.Timer(duration, self._finish, args=(duration, timed_out, stdout))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _finish(self, duration, timed_out, stdout):
+        with self._lock:
+            if self.done():
+                return
+
+            self.timed_out = timed_out
+
+            if not timed_out:
+                self.stdout.write(stdout)
+                self.stderr.write(self.recording["stderr"])
+                self.completed = subprocess.CompletedProcess(self.cmd, self.recording["returncode"], self.stdout, self.stderr)
+
+                # Replayed instantly the runtimes are still those of the tools
+                if not self.diverged:
+                    self.runtime = duration
+
+            self.stdout.close()
+            self.stderr.close()
+            self._set_done()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+
+            if self._timer is not None:
+                self._timer.cancel()
+
+            if not self.done():
+                self._set_done()
+
+    def result(self):
+        # The recorded test has not needed the result of the run
+        if self.missing and not self.cancelled:
+            raise base.InvalidTestCaseError("replay: no recording of {}".format(self.name))
+
+        return super().result()
+
+# Runs independent tools concurrently. All runs which are still active when the
+# group is left are cancelled.
+class ToolRunGroup:
+    def __init__(self):
+        self.runs = []
+        self._finished = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel()
+        return False
+
+    def start(self, name, cmd, timeout, env=None, expected_stdout=None, capture_limit=DEFAULT_CAPTURE_LIMIT):
+        run = ToolRun(name, cmd, timeout, env, self._finished, expected_stdout, capture_limit)
+        self.runs.append(run)
+
+        return run
+
+    def replay(self, name, cmd, timeout, recording, instant=False, expected_stdout=None, capture_limit=DEFAULT_CAPTURE_LIMIT):
+        run = ReplayedRun(name, cmd, timeout, recording, instant, self._finished, expected_stdout, capture_limit)
+        self.runs.append(run)
+
+        return run
+
+    def as_completed(self):
+        for _ in range(len([run for run in self.runs if not run.missing])):
+            yield self._finished.get()
+
+        # Runs without a recording were cancelled during the recording, i.e.
+        # they would finish last
+        for run in self.runs:
+            if run.missing:
+                yield run
+
+    def cancel(self):
+        for run in self.runs:
+            if not run.done():
+                run.cancel()
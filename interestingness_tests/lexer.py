@@ -0,0 +1,72 @@
+import hashlib
+import re
+
+# Lightweight OpenCL C lexer which is just precise enough to decide whether two
+# test cases only differ in their formatting
+_token_regex = re.compile(r"""
+    (?P<whitespace>(?:[ \t\f\v\r]|\\\r?\n)+)
+  | (?P<newline>\n)
+  | (?P<comment>//(?:\\\r?\n|[^\n])*|/\*.*?\*/)
+  | (?P<literal>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<number>\.?[0-9](?:[eEpP][+-]|[0-9a-zA-Z_.])*)
+  | (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<punctuator>\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||\#\#|[-+*/%&|^]=|[][(){}.&*+\-~!/%<>^|?:;=,\#])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# cl_launcher reads the work sizes from the first line of the test case
+_header_regex = re.compile(r"//[^\n]*")
+
+def tokenize(content):
+    line_start = True
+    directive = False
+    space = False
+    previous = None
+
+    for m in _token_regex.finditer(content):
+        kind = m.lastgroup
+
+        if kind == "whitespace" or kind == "comment":
+            # Whitespace is only significant inside of preprocessor directives,
+            # e.g. to distinguish function-like and object-like macros
+            space = True
+            continue
+
+        if kind == "newline":
+            if directive:
+                yield "\n"
+
+            line_start = True
+            directive = False
+            space = False
+            continue
+
+        token = m.group()
+
+        if line_start and token == "#":
+            directive = True
+        elif directive and space and previous != "#":
+            yield " "
+
+        line_start = False
+        space = False
+        previous = token
+
+        yield token
+
+def get_token_digest(content):
+    digest = hashlib.sha256()
+    header = _header_regex.match(content)
+
+    if header is not None:
+        digest.update(header.group().encode())
+
+    for token in tokenize(content):
+        digest.update(b"\0")
+        digest.update(token.encode())
+
+    return digest.hexdigest()
+
+def get_file_token_digest(test_case):
+    with open(test_case, "r") as test_file:
+        return get_token_digest(test_file.read())
@@ -0,0 +1,117 @@
+from interestingness_tests import static_checks
+import os
+
+try:
+    from clang import cindex
+except ImportError:
+    cindex = None
+
+_index = None
+_unavailable = False
+
+def get_index(library_file=None):
+    global _index
+    global _unavailable
+
+    if _index is not None or _unavailable:
+        return _index
+
+    if cindex is None:
+        _unavailable = True
+        return None
+
+    try:
+        if library_file is not None and not cindex.Config.loaded:
+            cindex.Config.set_library_file(library_file)
+
+        _index = cindex.Index.create()
+    except cindex.LibclangError:
+        _unavailable = True
+
+    return _index
+
+def is_available(library_file=None):
+    return get_index(library_file) is not None
+
+if cindex is not None:
+    _cast_kinds = (cindex.CursorKind.CSTYLE_CAST_EXPR, cindex.CursorKind.UNEXPOSED_EXPR)
+
+    # Pointer to bool casts are not PointerToIntegral casts
+    _integral_kinds = (cindex.TypeKind.CHAR_U, cindex.TypeKind.UCHAR, cindex.TypeKind.CHAR16, cindex.TypeKind.CHAR32,
+                       cindex.TypeKind.USHORT, cindex.TypeKind.UINT, cindex.TypeKind.ULONG, cindex.TypeKind.ULONGLONG,
+                       cindex.TypeKind.UINT128, cindex.TypeKind.CHAR_S, cindex.TypeKind.SCHAR, cindex.TypeKind.WCHAR,
+                       cindex.TypeKind.SHORT, cindex.TypeKind.INT, cindex.TypeKind.LONG, cindex.TypeKind.LONGLONG,
+                       cindex.TypeKind.INT128)
+
+    _severities = {
+        cindex.Diagnostic.Note: "note",
+        cindex.Diagnostic.Warning: "warning",
+        cindex.Diagnostic.Error: "error",
+        cindex.Diagnostic.Fatal: "fatal error",
+    }
+
+def _is_pointer_to_integral_cast(cursor):
+    if cursor.kind not in _cast_kinds:
+        return False
+
+    # Casts to typedefs, e.g. (size_t)p, have a TYPE_REF child in front of the
+    # operand
+    children = [c for c in cursor.get_children() if c.kind != cindex.CursorKind.TYPE_REF]
+
+    if not children:
+        return False
+
+    return (children[-1].type.get_canonical().kind == cindex.TypeKind.POINTER and
+            cursor.type.get_canonical().kind in _integral_kinds)
+
+def _has_pointer_to_integral_cast(translation_unit, test_case):
+    # Only walk the test case itself and not the included libclc headers
+    test_case = os.path.abspath(test_case)
+    cursors = [c for c in translation_unit.cursor.get_children()
+               if c.location.file is not None and os.path.abspath(c.location.file.name) == test_case]
+
+    while cursors:
+        cursor = cursors.pop()
+
+        if _is_pointer_to_integral_cast(cursor):
+            return True
+
+        cursors.extend(cursor.get_children())
+
+    return False
+
+def _format_diagnostic(diagnostic):
+    # Same format as clang uses on the command line to be able to reuse the rules
+    line = "{}: {}".format(_severities.get(diagnostic.severity, "warning"), diagnostic.spelling)
+
+    if diagnostic.option:
+        line += " [{}]".format(diagnostic.option)
+
+    return line
+
+# Equivalent of static_checks.get_ast_rejection and get_clang_rejection for a
+# fused clang invocation but without spawning clang. Parsing in-process cannot be
+# interrupted, i.e. CREDUCE_TEST_TIMEOUT does not apply to it.
+def get_frontend_rejection(test_case, args, library_file=None):
+    index = get_index(library_file)
+
+    try:
+        translation_unit = index.parse(test_case, args=args)
+    except cindex.TranslationUnitLoadError:
+        return "ast: clang failed"
+
+    diagnostics = list(translation_unit.diagnostics)
+
+    if any(d.severity >= cindex.Diagnostic.Error for d in diagnostics):
+        return "ast: clang failed"
+
+    if _has_pointer_to_integral_cast(translation_unit, test_case):
+        return "ast: PointerToIntegral"
+
+    output = "\n".join(_format_diagnostic(d) for d in diagnostics)
+    rule = static_checks.find_rule(output, static_checks.CLANG_RULES)
+
+    if rule is not None:
+        return "clang: {}".format(rule)
+
+    return None
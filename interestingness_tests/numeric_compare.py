@@ -0,0 +1,107 @@
+import io
+import itertools
+import math
+
+class Mismatch:
+    def __init__(self, line, field, expected, actual, array=None):
+        self.line = line
+        self.field = field
+        self.expected = expected
+        self.actual = actual
+        # Label of the array the mismatch is in if the dump names its arrays
+        self.array = array
+
+    def __str__(self):
+        return "line {}, field {}: expected {}, got {}".format(self.line, self.field, self.expected, self.actual)
+
+# Lines which start with a word, e.g. "A 1.0 2.0", name the array their values
+# belong to. The markers of the dump are not names.
+def _get_array_label(line):
+    if not line or not line[0].isalpha():
+        return None
+
+    label = line.split(None, 1)[0]
+
+    if _parse_number(label) is not None:
+        return None
+
+    return label
+
+def _parse_number(token):
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+# Same criterion as numdiff: two numbers only differ if both the absolute and
+# the relative error exceed their tolerances. The relative error is relative
+# to the expected number.
+def _differ(expected, actual, absolute_tolerance, relative_tolerance):
+    expected_number = _parse_number(expected)
+    actual_number = _parse_number(actual)
+
+    if expected_number is None or actual_number is None:
+        return expected != actual
+
+    if math.isnan(expected_number) or math.isnan(actual_number):
+        return not (math.isnan(expected_number) and math.isnan(actual_number))
+
+    if expected_number == actual_number:
+        return False
+
+    if math.isinf(expected_number) or math.isinf(actual_number):
+        return True
+
+    error = abs(expected_number - actual_number)
+
+    if expected_number != 0:
+        relative_error = error / abs(expected_number)
+    else:
+        relative_error = math.inf
+
+    return error > absolute_tolerance and relative_error > relative_tolerance
+
+def _find_mismatching_field(expected_fields, actual_fields, absolute_tolerance, relative_tolerance):
+    for (i, (expected, actual)) in enumerate(zip(expected_fields, actual_fields)):
+        if _differ(expected, actual, absolute_tolerance, relative_tolerance):
+            return i
+
+    return None
+
+# Compares two outputs line by line and field by field, fields are separated by
+# whitespace. The outputs are strings or iterables of lines, e.g. the lines of
+# a spilled output, which are consumed lazily. Lines which are equal are not
+# parsed at all. Returns the first Mismatch or None if the outputs are equal
+# within the tolerances.
+def compare(expected, actual, absolute_tolerance=1e-2, relative_tolerance=0.0):
+    if isinstance(expected, str):
+        expected = io.StringIO(expected)
+
+    if isinstance(actual, str):
+        actual = io.StringIO(actual)
+
+    lines = itertools.zip_longest(expected, actual)
+    array = None
+
+    for (line_number, (expected_line, actual_line)) in enumerate(lines, 1):
+        array = _get_array_label(expected_line) or array
+
+        if expected_line == actual_line:
+            continue
+
+        expected_fields = expected_line.split() if expected_line is not None else []
+        actual_fields = actual_line.split() if actual_line is not None else []
+        length = min(len(expected_fields), len(actual_fields))
+
+        field = _find_mismatching_field(expected_fields[:length], actual_fields[:length], absolute_tolerance, relative_tolerance)
+
+        if field is None and len(expected_fields) != len(actual_fields):
+            field = length
+
+        if field is not None:
+            expected_field = expected_fields[field] if field < len(expected_fields) else "<end of line>"
+            actual_field = actual_fields[field] if field < len(actual_fields) else "<end of line>"
+
+            return Mismatch(line_number, field + 1, expected_field, actual_field, array)
+
+    return None
@@ -1,10 +1,30 @@
 from interestingness_tests import base
+from interestingness_tests import execution
+from interestingness_tests import lexer
+from interestingness_tests import shared_checks
+from interestingness_tests import static_checks
+import collections
 import os
 import platform
 import re
-import subprocess
+import sys
+
+class OpenCLInterestingnessTest(shared_checks.SharedChecksMixin, base.InterestingnessTest):
+    @staticmethod
+    def __get_targets(targets_str):
+        targets = []
+
+        for target_str in targets_str.split(","):
+            m = re.fullmatch(r"\s*([0-9]+)\s*:\s*([0-9]+)\s*", target_str)
+
+            if m is None:
+                print("Invalid targets!")
+                sys.exit(1)
+
+            targets.append((int(m.group(1)), int(m.group(2))))
+
+        return targets
 
-class OpenCLInterestingnessTest(base.InterestingnessTest):
     @classmethod
     def get_test_options(cls, env):
         options = super().get_test_options(env)
@@ -16,6 +36,7 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         options["device"] = env.get("CREDUCE_TEST_DEVICE")
         options["timeout"] = env.get("CREDUCE_TEST_TIMEOUT")
         options["conservative"] = env.get("CREDUCE_TEST_CONSERVATIVE")
+        options["targets"] = env.get("CREDUCE_TEST_TARGETS")
 
         return options
 
@@ -60,64 +81,72 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         else:
             self.conservative = True
 
-    def _run_clang(self, test_case, timeout, extra_args=None):
-        cmd = [self.clang]
-        cmd.extend(["-x", "cl", "-fno-builtin", "-include", "clc/clc.h", "-Dcl_clang_storage_class_specifiers", "-g", "-c", "-Wall", "-Wextra", "-pedantic", "-Wconditional-uninitialized", "-Weverything", "-Wno-reserved-id-macro", "-fno-caret-diagnostics", "-fno-diagnostics-fixit-info", "-O1"])
-
-        if self.libclc_include_path is not None:
-            cmd.extend(["-I", self.libclc_include_path])
+        # Platform and device pairs on which the test case is run
+        if "targets" in self.options and self.options["targets"] is not None:
+            self.targets = self.__get_targets(str(self.options["targets"]))
+        else:
+            self.targets = [(self.platform, self.device)]
 
-        if extra_args is not None:
-            cmd.extend(extra_args)
+        # Verdict for each target of the last comparison with the device
+        self.target_verdicts = collections.OrderedDict()
 
-        cmd.append(test_case)
+    def get_tools(self):
+        return super().get_tools() + [self.clang, self.cl_launcher, "oclgrind"]
 
-        try:
-            return subprocess.run(cmd, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("clang")
-        except subprocess.SubprocessError:
-            return None
+    def _run_clang(self, test_case, timeout, extra_args=None):
+        return self._run_tool("clang", self._get_clang_cmd(test_case, timeout, extra_args), timeout)
 
     def _run_csa(self, test_case, timeout):
         #TODO: Maybe use scan-build?!
-        #csa_args = ["-Xclang", "-analyze", "-Xclang", "-analyzer-checker", "-Xclang", "alpha,core,security,unix"]
-        csa_args = ["--analyze", "-Xclang", "-analyzer-checker", "-Xclang", "alpha,core,security,unix"]
+        return self._run_tool("clang static analyzer", self._get_clang_cmd(test_case, timeout, static_checks.CSA_ARGS), timeout)
 
-        try:
-            return self._run_clang(test_case, timeout, csa_args)
-        except base.TestTimeoutError:
-            raise base.TestTimeoutError("clang static analyzer")
+    @staticmethod
+    def _get_oclgrind_tool_name(instrumented):
+        # Both kinds of runs have very different runtimes
+        if instrumented:
+            return "oclgrind"
+        else:
+            return "oclgrind (uninstrumented)"
 
-    def _run_oclgrind(self, test_case, timeout, optimised):
+    def _get_oclgrind_cmd(self, test_case, optimised, instrumented=True):
         cmd = ["oclgrind"]
-        cmd.extend(["-Wall", "--uninitialized", "--arithmetic-exceptions", "--data-races", "--uniform-writes", "--stop-errors", "1"])
+
+        if instrumented:
+            cmd.extend(["-Wall", "--uninitialized", "--arithmetic-exceptions", "--data-races", "--uniform-writes", "--stop-errors", "1"])
+
         cmd.append(self.cl_launcher)
         cmd.extend(["-p", "0", "-d", "0", "-f", test_case])
 
         if not optimised:
             cmd.append("---disable_opts")
 
-        try:
-            return subprocess.run(cmd, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("oclgrind")
-        except subprocess.SubprocessError:
-            return None
+        return cmd
 
-    def _run_cl_launcher(self, test_case, platform, device, timeout, optimised):
+    def _run_oclgrind(self, test_case, timeout, optimised, instrumented=True):
+        return self._run_tool(self._get_oclgrind_tool_name(instrumented), self._get_oclgrind_cmd(test_case, optimised, instrumented), timeout)
+
+    def _get_cl_launcher_cmd(self, test_case, platform, device, optimised):
         cmd = [self.cl_launcher]
         cmd.extend(["-p", str(platform), "-d", str(device), "-f", test_case])
 
         if not optimised:
             cmd.append("---disable_opts")
 
-        try:
-            return subprocess.run(cmd, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("cl_launcher")
-        except subprocess.SubprocessError:
-            return None
+        return cmd
+
+    @staticmethod
+    def get_target_name(target):
+        return "{}:{}".format(*target)
+
+    def _get_cl_launcher_tool_name(self, target):
+        # Devices have very different runtimes
+        if len(self.targets) == 1:
+            return "cl_launcher"
+        else:
+            return "cl_launcher ({})".format(self.get_target_name(target))
+
+    def _run_cl_launcher(self, test_case, platform, device, timeout, optimised):
+        return self._run_tool("cl_launcher", self._get_cl_launcher_cmd(test_case, platform, device, optimised), timeout)
 
     def is_valid_result_access(self, test_case):
         with open(test_case, "r") as test_file:
@@ -141,60 +170,17 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         except base.TestTimeoutError:
             raise base.TestTimeoutError("clang ast")
 
-        if proc is None or proc.returncode != 0:
-            return False
-
-        if (r"PointerToIntegral" not in proc.stdout):
-            return True
-
-        return False
+        return static_checks.get_ast_rejection(proc) is None
 
     def is_valid_clang(self, test_case, timeout):
         proc = self._run_clang(test_case, timeout)
 
-        if proc is None or proc.returncode != 0:
-            return False
-
-        if (r"warning: empty struct is a GNU extension" not in proc.stderr and
-            r"warning: use of GNU empty initializer extension" not in proc.stderr and
-            r"warning: incompatible pointer to integer conversion" not in proc.stderr and
-            r"warning: incompatible integer to pointer conversion" not in proc.stderr and
-            r"warning: incompatible pointer types initializing" not in proc.stderr and
-            r"warning: comparison between pointer and integer" not in proc.stderr and
-            r"warning: ordered comparison between pointer and integer" not in proc.stderr and
-            r"warning: ordered comparison between pointer and zero" not in proc.stderr and
-            r"is uninitialized when used within its own initialization [-Wuninitialized]" not in proc.stderr and
-            r"is uninitialized when used here [-Wuninitialized]" not in proc.stderr and
-            r"may be uninitialized when used here [-Wconditional-uninitialized]" not in proc.stderr and
-            r"warning: use of GNU ?: conditional expression extension, omitting middle operand" not in proc.stderr and
-            r"warning: control may reach end of non-void function [-Wreturn-type]" not in proc.stderr and
-            r"warning: control reaches end of non-void function [-Wreturn-type]" not in proc.stderr and
-            r"warning: zero size arrays are an extension [-Wzero-length-array]" not in proc.stderr and
-            r"excess elements in " not in proc.stderr and
-            r"warning: address of stack memory associated with local variable" not in proc.stderr and
-            r"warning: type specifier missing" not in proc.stderr and
-            r"warning: expected ';' at end of declaration list" not in proc.stderr and
-            r" declaration specifier [-Wduplicate-decl-specifier]" not in proc.stderr):
-            return True
-
-        return False
+        return static_checks.get_clang_rejection(proc) is None
 
     def is_valid_csa(self, test_case, timeout):
         proc = self._run_csa(test_case, timeout)
 
-        if proc is None or proc.returncode != 0:
-            return False
-
-        if ("warning: Assigned value is garbage or undefined" not in proc.stderr and
-            "warning: Undefined or garbage value returned to caller" not in proc.stderr and
-            "is a garbage value" not in proc.stderr and
-            "warning: Function call argument is an uninitialized value" not in proc.stderr and
-            "warning: Dereference of null pointer" not in proc.stderr and
-            "warning: Array subscript is undefined" not in proc.stderr and
-            "results in a dereference of a null pointer" not in proc.stderr):
-            return True
-
-        return False
+        return static_checks.get_csa_rejection(proc) is None
 
     def is_valid_cl_launcher_test_case(self, test_case):
         with open(test_case, "r") as test_file:
@@ -222,20 +208,6 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
 
         return True
 
-    def is_statically_valid(self, test_case, timeout):
-        if not self.is_valid_ast(test_case, timeout):
-            return False
-
-        # Run static analysis of the program
-        # Better support for uninitialised values
-        if not self.is_valid_clang(test_case, timeout):
-            return False
-
-        if not self.is_valid_csa(test_case, timeout):
-            return False
-
-        return True
-
     def is_valid_oclgrind(self, test_case, timeout, optimised):
         #TODO: Necessary to run both?
         proc = self._run_oclgrind(test_case, timeout, optimised)
@@ -245,21 +217,50 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
 
         return True
 
-    def get_oracle_result(self, test_case, timeout):
-        proc_opt = self._run_oclgrind(test_case, timeout, optimised=True)
+    # Without instrumentation Oclgrind only provides the output and does not
+    # check the test case for undefined behaviour
+    def get_oracle_result(self, test_case, timeout, instrumented=True):
+        if self.result_cache is None:
+            return self._get_oracle_result(test_case, timeout, instrumented)
 
-        if proc_opt is None or proc_opt.returncode != 0:
-            return None
+        kind = "oracle" if instrumented else "oracle:uninstrumented"
+        key = self.result_cache.get_key(kind, lexer.get_file_token_digest(test_case), [self.cl_launcher, "oclgrind"])
+        entry = self.result_cache.lookup(key)
 
-        proc_unopt = self._run_oclgrind(test_case, timeout, optimised=False)
+        if entry is not None:
+            return entry["oracle"]
 
-        if proc_unopt is None or proc_unopt.returncode != 0:
-            return None
+        oracle = self._get_oracle_result(test_case, timeout, instrumented)
+
+        # The cache keeps the complete output of the oracle
+        self.result_cache.store(key, {"oracle": str(oracle) if oracle is not None else None})
+
+        return oracle
+
+    def _get_oracle_result(self, test_case, timeout, instrumented):
+        name = self._get_oclgrind_tool_name(instrumented)
+
+        # Both runs are independent of each other
+        with execution.ToolRunGroup() as group:
+            run_opt = self._start_tool(group, name, self._get_oclgrind_cmd(test_case, optimised=True, instrumented=instrumented), timeout)
+            run_unopt = self._start_tool(group, name, self._get_oclgrind_cmd(test_case, optimised=False, instrumented=instrumented), timeout)
+
+            # Bail out as soon as one of the runs failed
+            for run in group.as_completed():
+                proc = run.result()
+
+                if proc is None or proc.returncode != 0:
+                    return None
+
+            proc_opt = run_opt.result()
+            proc_unopt = run_unopt.result()
 
         # Check for error in Oclgrind/Clang
         if proc_opt.stdout != proc_unopt.stdout:
             return None
 
+        # The oracle is kept to compare it with the device runs, compared with
+        # another output only the digests are used
         return proc_opt.stdout
 
     def is_valid_cl_launcher(self, test_case, platform, device, timeout, optimised):
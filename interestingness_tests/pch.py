@@ -0,0 +1,73 @@
+from interestingness_tests import cache
+import hashlib
+import os
+import subprocess
+import tempfile
+
+# Identifies the content of all headers below the include path since clc.h
+# includes the headers of all builtins
+def get_headers_identity(include_path):
+    identity = []
+
+    for (root, dirs, files) in os.walk(include_path):
+        dirs.sort()
+
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            identity.append("{}:{}:{}".format(os.path.relpath(path, include_path), stat.st_size, stat.st_mtime_ns))
+
+    return "\n".join(identity)
+
+def get_clc_pch(clang, clang_args, libclc_include_path, pch_dir, timeout):
+    header = os.path.join(libclc_include_path, "clc", "clc.h")
+
+    if not os.path.isfile(header):
+        return None
+
+    # A new PCH is built whenever clang, its arguments or any libclc header
+    # change
+    digest = hashlib.sha256()
+    digest.update(cache.get_tool_identity(clang).encode())
+    digest.update(" ".join(clang_args).encode())
+    digest.update(os.path.realpath(libclc_include_path).encode())
+    digest.update(get_headers_identity(libclc_include_path).encode())
+
+    pch = os.path.join(pch_dir, "clc-{}.pch".format(digest.hexdigest()[:16]))
+    failed = pch + ".failed"
+
+    if os.path.exists(pch):
+        return pch
+
+    # Do not retry to build the PCH for every single test case
+    if os.path.exists(failed):
+        return None
+
+    os.makedirs(pch_dir, exist_ok=True)
+
+    (fd, tmp_pch) = tempfile.mkstemp(suffix=".pch", dir=pch_dir)
+    os.close(fd)
+
+    cmd = [clang]
+    cmd.extend(clang_args)
+    cmd.extend(["-Xclang", "-emit-pch", "-o", tmp_pch, header])
+
+    try:
+        proc = subprocess.run(cmd, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        # A loaded machine might only be slow this time, the next test case
+        # tries again
+        os.remove(tmp_pch)
+        return None
+    except subprocess.SubprocessError:
+        proc = None
+
+    if proc is None or proc.returncode != 0:
+        os.remove(tmp_pch)
+        open(failed, "w").close()
+        return None
+
+    # Parallel interestingness tests might build the same PCH concurrently
+    os.replace(tmp_pch, pch)
+
+    return pch
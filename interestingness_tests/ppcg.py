@@ -2,11 +2,14 @@
 
 from enum import Enum
 from interestingness_tests import base
+from interestingness_tests import execution
+from interestingness_tests import numeric_compare
 from interestingness_tests import ppcg_opencl
+from interestingness_tests import stages
+import io
+import itertools
 import os
 import sys
-import subprocess
-import itertools
 
 class PPCGInterestingnessTest(ppcg_opencl.OpenCLInterestingnessTest):
     class OptimisationLevel(Enum):
@@ -39,6 +42,9 @@ class PPCGInterestingnessTest(ppcg_opencl.OpenCLInterestingnessTest):
         options["use_oracle"] = env.get("CREDUCE_TEST_USE_ORACLE")
         options["optimisation_level"] = env.get("CREDUCE_TEST_OPTIMISATION_LEVEL")
         options["check_static"] = env.get("CREDUCE_TEST_STATIC")
+        options["numdiff"] = env.get("CREDUCE_TEST_NUMDIFF")
+        options["absolute_tolerance"] = env.get("CREDUCE_TEST_ABSOLUTE_TOLERANCE")
+        options["relative_tolerance"] = env.get("CREDUCE_TEST_RELATIVE_TOLERANCE")
 
         return options
 
@@ -60,17 +66,66 @@ class PPCGInterestingnessTest(ppcg_opencl.OpenCLInterestingnessTest):
         else:
             self.check_static = True
 
-    def check(self):
+        if "numdiff" in self.options and self.options["numdiff"] is not None:
+            self.numdiff = str(self.options["numdiff"])
+
+            if self.numdiff not in ("builtin", "external"):
+                print("Invalid numdiff mode!")
+                sys.exit(1)
+        else:
+            self.numdiff = "builtin"
+
+        if "absolute_tolerance" in self.options and self.options["absolute_tolerance"] is not None:
+            self.absolute_tolerance = float(self.options["absolute_tolerance"])
+        else:
+            self.absolute_tolerance = 1e-2
+
+        if "relative_tolerance" in self.options and self.options["relative_tolerance"] is not None:
+            self.relative_tolerance = float(self.options["relative_tolerance"])
+        else:
+            self.relative_tolerance = None
 
-        # print("Hugues: start check")
+        # Location of the first difference in the dumped arrays
+        self.array_mismatch = None
+        # Part of the output which differs in the last comparison ("stdout" or
+        # "arrays"), None if nothing has been compared or nothing differs
+        self.output_mismatch = None
+
+    def get_tools(self):
+        if self.numdiff == "external":
+            return super().get_tools() + [os.getenv("NUMDIFF", "numdiff")]
+
+        return super().get_tools()
+
+    def check(self):
+        check_stages = []
 
         if self.check_static:
-            if not self.is_statically_valid(self.test_case, self.timeout):
-                raise base.InvalidTestCaseError("static")
+            check_stages.append(stages.Stage("static", self._check_static))
+
+        # Always use OCLGring as oracle
+        if self.tiered_oracle:
+            # Interesting test cases are confirmed with the fully instrumented
+            # oracle
+            check_stages.append(stages.Stage("uninstrumented_oracle", self._check_uninstrumented_oracle))
+            check_stages.append(stages.Stage("ppcg_host", self._check_ppcg_host_against_uninstrumented_oracle, [s.name for s in check_stages]))
+            check_stages.append(stages.Stage("oracle", self._confirm_oracle, ["ppcg_host"]))
+        else:
+            check_stages.append(stages.Stage("oracle", self._check_oracle))
+            check_stages.append(stages.Stage("ppcg_host", self._check_ppcg_host, [s.name for s in check_stages]))
+
+        return self.run_stages(check_stages)
+
+    def _check_static(self, results):
+        rejection = self.get_static_rejection(self.test_case, self.timeout)
+
+        if rejection is not None:
+            raise base.InvalidTestCaseError("static ({})".format(rejection))
+
+    def _check_oracle(self, results):
 
         # print("Hugues: start get_oracle_result")
 
-        # Always use OCLGring as oracle
         oracle = self.get_oracle_result(self.test_case, self.timeout)
 
         # print("Hugues: oracle is done, and it is :")
@@ -79,6 +134,53 @@ class PPCGInterestingnessTest(ppcg_opencl.OpenCLInterestingnessTest):
         if oracle is None:
             raise base.InvalidTestCaseError("oracle")
 
+        return oracle
+
+    def _check_uninstrumented_oracle(self, results):
+        # Oclgrind fails with instrumentation as well if it fails without
+        oracle = self.get_oracle_result(self.test_case, self.timeout, instrumented=False)
+
+        if oracle is None:
+            raise base.InvalidTestCaseError("oracle")
+
+        return oracle
+
+    def _check_ppcg_host_against_uninstrumented_oracle(self, results):
+        if not self._compare_ppcg_host_with_oracle(results["uninstrumented_oracle"]):
+            raise stages.StageRejection("ppcg_host")
+
+        return True
+
+    def _confirm_oracle(self, results):
+        oracle = self._check_oracle(results)
+        uninstrumented_oracle = results["uninstrumented_oracle"]
+
+        # Instrumentation warnings are printed before the dumped arrays
+        if (oracle.stdout == uninstrumented_oracle.stdout and
+            all(a == b for (a, b) in itertools.zip_longest(self.get_array_dump(oracle.stderr), self.get_array_dump(uninstrumented_oracle.stderr)))):
+            return True
+
+        return self._compare_ppcg_host_with_oracle(oracle)
+
+    def _check_ppcg_host(self, results):
+        return self._compare_ppcg_host_with_oracle(results["oracle"])
+
+    # Yields the lines of the dumped arrays. Captured output which has been
+    # spilled to a file is read chunk by chunk.
+    @staticmethod
+    def get_array_dump(output):
+        lines = output.lines() if isinstance(output, execution.Output) else io.StringIO(output)
+        dumping = False
+
+        # As oclgrind may emit some warning in stderr, skip all lines before "==BEGIN DUMP_ARRAYS=="
+        for line in lines:
+            if not dumping and line.rstrip("\n") == "==BEGIN DUMP_ARRAYS==":
+                dumping = True
+
+            if dumping:
+                yield line
+
+    def _compare_ppcg_host_with_oracle(self, oracle):
         # print("Hugues: start run ppcg host")
 
         proc = self._run_ppcg_host(self.test_case, self.platform, self.device, self.timeout)
@@ -99,31 +201,47 @@ class PPCGInterestingnessTest(ppcg_opencl.OpenCLInterestingnessTest):
         #     if keepline:
         #         oracle_processed += l + "\n"
 
+        # Compare proc and oracle output
+        if proc.stdout != oracle.stdout:
+            self.output_mismatch = "stdout"
+            return True
+
+        if self.numdiff == "external":
+            differs = self._compare_with_numdiff(oracle, proc)
+        else:
+            self.array_mismatch = numeric_compare.compare(self.get_array_dump(oracle.stderr), self.get_array_dump(proc.stderr),
+                                                          self.absolute_tolerance, self.relative_tolerance or 0.0)
+            differs = self.array_mismatch is not None
+
+        self.output_mismatch = "arrays" if differs else None
+
+        return differs
+
+    def _compare_with_numdiff(self, oracle, proc):
         # Compare using numdiff
         with open("oracle.stderr", 'w') as f:
-            oracle_processed = "\n".join(list(itertools.dropwhile(lambda s : s != "==BEGIN DUMP_ARRAYS==", oracle.stderr.split("\n"))))
-            f.write(oracle_processed)
+            f.writelines(self.get_array_dump(oracle.stderr))
             #f.write(oracle.stderr)
 
         with open("proc.stderr", 'w') as f:
-            proc_processed = "\n".join(list(itertools.dropwhile(lambda s : s != "==BEGIN DUMP_ARRAYS==", proc.stderr.split("\n"))))
-            f.write(proc_processed)
+            f.writelines(self.get_array_dump(proc.stderr))
 
         numdiff = os.getenv("NUMDIFF", "numdiff")
 
         cmd = [
             numdiff,
-            "--absolute-tolerance=1e-2",
+            "--absolute-tolerance={}".format(self.absolute_tolerance),
             "oracle.stderr",
             "proc.stderr"
         ]
 
-        try:
-            numdiff_ret = subprocess.run(cmd, universal_newlines=True, timeout=self.timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("numdiff")
+        if self.relative_tolerance is not None:
+            cmd.insert(2, "--relative-tolerance={}".format(self.relative_tolerance))
+
+        numdiff_ret = self._run_tool("numdiff", cmd, self.timeout)
+
         # FIXME!!
-        except subprocess.SubprocessError:
+        if numdiff_ret is None:
             print("FIXME: subprocess error with numdiff")
             return False
 
@@ -1,11 +1,14 @@
 from interestingness_tests import base
+from interestingness_tests import lexer
+from interestingness_tests import shared_checks
+from interestingness_tests import static_checks
 import os
 import platform
 import re
 import subprocess
 import sys
 
-class OpenCLInterestingnessTest(base.InterestingnessTest):
+class OpenCLInterestingnessTest(shared_checks.SharedChecksMixin, base.InterestingnessTest):
     @classmethod
     def get_test_options(cls, env):
         options = super().get_test_options(env)
@@ -64,39 +67,34 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         else:
             self.conservative = True
 
-    def _run_clang(self, test_case, timeout, extra_args=None):
-        cmd = [self.clang]
-        cmd.extend(["-x", "cl", "-fno-builtin", "-include", "clc/clc.h", "-Dcl_clang_storage_class_specifiers", "-g", "-c", "-Wall", "-Wextra", "-pedantic", "-Wconditional-uninitialized", "-Weverything", "-Wno-reserved-id-macro", "-fno-caret-diagnostics", "-fno-diagnostics-fixit-info", "-O1"])
-
-        if self.libclc_include_path is not None:
-            cmd.extend(["-I", self.libclc_include_path])
-
-        if extra_args is not None:
-            cmd.extend(extra_args)
+    def get_tools(self):
+        tools = super().get_tools() + [self.clang, "oclgrind"]
 
-        cmd.append(test_case)
+        if self.host_exec_dir is not None:
+            tools.append(os.path.join(self.host_exec_dir, self.test_case.replace("_kernel.cl", "")))
 
-        try:
-            return subprocess.run(cmd, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return tools
 
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("clang")
-        except subprocess.SubprocessError:
-            return None
+    def _run_clang(self, test_case, timeout, extra_args=None):
+        return self._run_tool("clang", self._get_clang_cmd(test_case, timeout, extra_args), timeout)
 
     def _run_csa(self, test_case, timeout):
         #TODO: Maybe use scan-build?!
-        #csa_args = ["-Xclang", "-analyze", "-Xclang", "-analyzer-checker", "-Xclang", "alpha,core,security,unix"]
-        csa_args = ["--analyze", "-Xclang", "-analyzer-checker", "-Xclang", "alpha,core,security,unix"]
+        return self._run_tool("clang static analyzer", self._get_clang_cmd(test_case, timeout, static_checks.CSA_ARGS), timeout)
 
-        try:
-            return self._run_clang(test_case, timeout, csa_args)
-        except base.TestTimeoutError:
-            raise base.TestTimeoutError("clang static analyzer")
+    @staticmethod
+    def _get_oclgrind_tool_name(instrumented):
+        # Both kinds of runs have very different runtimes
+        if instrumented:
+            return "oclgrind"
+        else:
+            return "oclgrind (uninstrumented)"
 
-    def _run_oclgrind(self, test_case, timeout):
+    def _run_oclgrind(self, test_case, timeout, instrumented=True):
         cmd = ["oclgrind"]
-        cmd.extend(["-Wall", "--uninitialized", "--arithmetic-exceptions", "--data-races", "--uniform-writes", "--stop-errors", "1"])
+
+        if instrumented:
+            cmd.extend(["-Wall", "--uninitialized", "--arithmetic-exceptions", "--data-races", "--uniform-writes", "--stop-errors", "1"])
 
         # PPCG: recreate executable name from test_case
         execname = test_case.replace("_kernel.cl", "")
@@ -110,13 +108,7 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         # print("HUGUES: env path")
         # print(myenv['PATH'])
 
-        try:
-            return subprocess.run(cmd, env=myenv, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("oclgrind")
-        except subprocess.SubprocessError:
-            return None
+        return self._run_tool(self._get_oclgrind_tool_name(instrumented), cmd, timeout, myenv)
 
     def _run_ppcg_host(self, test_case, platform, device, timeout):
 
@@ -127,14 +119,7 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         myenv = os.environ.copy()
         myenv["PATH"] += ":" + self.host_exec_dir
 
-        try:
-
-            return subprocess.run(cmd, env=myenv, universal_newlines=True, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        except subprocess.TimeoutExpired:
-            raise base.TestTimeoutError("ppcg_host")
-        except subprocess.SubprocessError:
-            return None
+        return self._run_tool("ppcg_host", cmd, timeout, myenv)
 
     def is_valid_result_access(self, test_case):
         with open(test_case, "r") as test_file:
@@ -158,86 +143,60 @@ class OpenCLInterestingnessTest(base.InterestingnessTest):
         except base.TestTimeoutError:
             raise base.TestTimeoutError("clang ast")
 
-        if proc is None or proc.returncode != 0:
-            return False
-
-        if (r"PointerToIntegral" not in proc.stdout):
-            return True
-
-        return False
+        return static_checks.get_ast_rejection(proc) is None
 
     def is_valid_clang(self, test_case, timeout):
         proc = self._run_clang(test_case, timeout)
 
-        if proc is None or proc.returncode != 0:
-            return False
-
-        if (r"warning: empty struct is a GNU extension" not in proc.stderr and
-            r"warning: use of GNU empty initializer extension" not in proc.stderr and
-            r"warning: incompatible pointer to integer conversion" not in proc.stderr and
-            r"warning: incompatible integer to pointer conversion" not in proc.stderr and
-            r"warning: incompatible pointer types initializing" not in proc.stderr and
-            r"warning: comparison between pointer and integer" not in proc.stderr and
-            r"warning: ordered comparison between pointer and integer" not in proc.stderr and
-            r"warning: ordered comparison between pointer and zero" not in proc.stderr and
-            r"is uninitialized when used within its own initialization [-Wuninitialized]" not in proc.stderr and
-            r"is uninitialized when used here [-Wuninitialized]" not in proc.stderr and
-            r"may be uninitialized when used here [-Wconditional-uninitialized]" not in proc.stderr and
-            r"warning: use of GNU ?: conditional expression extension, omitting middle operand" not in proc.stderr and
-            r"warning: control may reach end of non-void function [-Wreturn-type]" not in proc.stderr and
-            r"warning: control reaches end of non-void function [-Wreturn-type]" not in proc.stderr and
-            r"warning: zero size arrays are an extension [-Wzero-length-array]" not in proc.stderr and
-            r"excess elements in " not in proc.stderr and
-            r"warning: address of stack memory associated with local variable" not in proc.stderr and
-            r"warning: type specifier missing" not in proc.stderr and
-            r"warning: expected ';' at end of declaration list" not in proc.stderr and
-            r" declaration specifier [-Wduplicate-decl-specifier]" not in proc.stderr):
-            return True
-
-        return False
+        return static_checks.get_clang_rejection(proc) is None
 
     def is_valid_csa(self, test_case, timeout):
         proc = self._run_csa(test_case, timeout)
 
+        return static_checks.get_csa_rejection(proc) is None
+
+    def is_valid_oclgrind(self, test_case, timeout, optimised):
+        #TODO: Necessary to run both?
+        # PPCG host programs cannot disable the optimisations
+        proc = self._run_oclgrind(test_case, timeout)
+
         if proc is None or proc.returncode != 0:
             return False
 
-        if ("warning: Assigned value is garbage or undefined" not in proc.stderr and
-            "warning: Undefined or garbage value returned to caller" not in proc.stderr and
-            "is a garbage value" not in proc.stderr and
-            "warning: Function call argument is an uninitialized value" not in proc.stderr and
-            "warning: Dereference of null pointer" not in proc.stderr and
-            "warning: Array subscript is undefined" not in proc.stderr and
-            "results in a dereference of a null pointer" not in proc.stderr):
-            return True
+        return True
 
-        return False
+    # Without instrumentation Oclgrind only provides the output and does not
+    # check the test case for undefined behaviour
+    def get_oracle_result(self, test_case, timeout, instrumented=True):
+        if self.result_cache is None:
+            return self._get_oracle_result(test_case, timeout, instrumented)
 
-    def is_statically_valid(self, test_case, timeout):
-        if not self.is_valid_ast(test_case, timeout):
-            return False
+        # The host program loads the kernel by name
+        kind = "ppcg_oracle:{}".format(os.path.basename(test_case))
 
-        # Run static analysis of the program
-        # Better support for uninitialised values
-        if not self.is_valid_clang(test_case, timeout):
-            return False
+        if not instrumented:
+            kind += ":uninstrumented"
 
-        if not self.is_valid_csa(test_case, timeout):
-            return False
+        key = self.result_cache.get_key(kind, lexer.get_file_token_digest(test_case), self.get_tools())
+        entry = self.result_cache.lookup(key)
 
-        return True
+        if entry is not None:
+            if entry["returncode"] is None:
+                return None
 
-    def is_valid_oclgrind(self, test_case, timeout, optimised):
-        #TODO: Necessary to run both?
-        proc = self._run_oclgrind(test_case, timeout, optimised)
+            return subprocess.CompletedProcess(entry["args"], entry["returncode"], entry["stdout"], entry["stderr"])
 
-        if proc is None or proc.returncode != 0:
-            return False
+        proc = self._get_oracle_result(test_case, timeout, instrumented)
 
-        return True
+        if proc is None:
+            self.result_cache.store(key, {"returncode": None})
+        else:
+            self.result_cache.store(key, {"args": proc.args, "returncode": proc.returncode, "stdout": str(proc.stdout), "stderr": str(proc.stderr)})
+
+        return proc
 
-    def get_oracle_result(self, test_case, timeout):
-        proc_opt = self._run_oclgrind(test_case, timeout)
+    def _get_oracle_result(self, test_case, timeout, instrumented):
+        proc_opt = self._run_oclgrind(test_case, timeout, instrumented)
 
         # print("Hugues: proc_opt is")
         # print(proc_opt)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import tempfile
+
+def get_file_digest(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def normalise_arg(arg):
+    # Directories, e.g. the libclc include path, and programs, e.g.
+    # cl_launcher run by Oclgrind, are installed at different places
+    if os.path.isdir(arg):
+        return "dir:{}".format(os.path.basename(os.path.normpath(arg)))
+
+    if os.path.isfile(arg):
+        if os.access(arg, os.X_OK):
+            return os.path.basename(arg)
+
+        # The PCH is built on every machine from its own headers
+        if arg.endswith(".pch"):
+            return "pch"
+
+        return "file:{}".format(get_file_digest(arg))
+
+    return arg
+
+# Identifies a tool invocation independently of the machine it runs on: the
+# executable is only identified by its name, directories and programs in the
+# arguments by their names and other files by their content. The test cases
+# are always part of the key because tools like the PPCG host programs read the
+# kernel without it being an argument.
+def get_key(name, cmd, test_cases):
+    args = [os.path.basename(cmd[0])]
+    args.extend(normalise_arg(arg) for arg in cmd[1:])
+
+    inputs = [get_file_digest(test_case) for test_case in test_cases if os.path.isfile(test_case)]
+
+    return hashlib.sha256(json.dumps([name, args, inputs]).encode()).hexdigest()
+
+# Directory with one JSON file per recorded tool invocation
+class Recordings:
+    def __init__(self, path):
+        self.path = path
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key[:2], "{}.json".format(key))
+
+    def lookup(self, key):
+        try:
+            with open(self._get_path(key), "r") as recording_file:
+                return json.load(recording_file)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, recording):
+        path = self._get_path(key)
+
+        # The first recording of an invocation is kept
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(path))
+
+        with os.fdopen(fd, "w") as recording_file:
+            json.dump(recording, recording_file)
+
+        # Parallel interestingness tests might record the same invocation
+        os.replace(tmp_path, path)
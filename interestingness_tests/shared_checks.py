@@ -0,0 +1,173 @@
+from interestingness_tests import base
+from interestingness_tests import cache
+from interestingness_tests import execution
+from interestingness_tests import lexer
+from interestingness_tests import libclang_backend
+from interestingness_tests import pch
+from interestingness_tests import static_checks
+
+# Options and checks shared by the OpenCL interestingness tests for CLsmith and
+# PPCG test cases. The tests provide self.clang, self.libclc_include_path and
+# self.timeout.
+class SharedChecksMixin:
+    uncached_options = base.InterestingnessTest.uncached_options + ("pch_dir",)
+
+    @classmethod
+    def get_test_options(cls, env):
+        options = super().get_test_options(env)
+
+        options["pch_dir"] = env.get("CREDUCE_TEST_PCH_DIR")
+        options["static_backend"] = env.get("CREDUCE_TEST_STATIC_BACKEND")
+        options["libclang"] = env.get("CREDUCE_TEST_LIBCLANG")
+        options["tiered_oracle"] = env.get("CREDUCE_TEST_TIERED_ORACLE")
+
+        return options
+
+    def __init__(self, test_cases, options):
+        super().__init__(test_cases, options)
+
+        if "pch_dir" in self.options and self.options["pch_dir"] is not None:
+            self.pch_dir = str(self.options["pch_dir"])
+        else:
+            self.pch_dir = None
+
+        self.clc_pch = None
+
+        if "static_backend" in self.options and self.options["static_backend"] is not None:
+            self.static_backend = str(self.options["static_backend"])
+        else:
+            self.static_backend = "clang"
+
+        if "libclang" in self.options and self.options["libclang"] is not None:
+            self.libclang = str(self.options["libclang"])
+        else:
+            self.libclang = None
+
+        if "tiered_oracle" in self.options and self.options["tiered_oracle"] is not None:
+            self.tiered_oracle = bool(int(self.options["tiered_oracle"]))
+        else:
+            self.tiered_oracle = False
+
+        # Memoize tool results for test cases which only differ in their formatting
+        if "cache" in self.options and self.options["cache"] is not None:
+            self.result_cache = cache.ResultCache(str(self.options["cache"]))
+        else:
+            self.result_cache = None
+
+    def prepare(self):
+        super().prepare()
+
+        self._get_clc_include_args(self.timeout)
+
+        if self.static_backend == "libclang":
+            libclang_backend.get_index(self.libclang)
+
+    def set_test_cases(self, test_cases):
+        super().set_test_cases(test_cases)
+
+        if len(self.test_cases) > 0:
+            self.test_case = self.test_cases[0]
+
+    def _get_clang_args(self):
+        args = ["-x", "cl", "-fno-builtin", "-Dcl_clang_storage_class_specifiers", "-g", "-c", "-Wall", "-Wextra", "-pedantic", "-Wconditional-uninitialized", "-Weverything", "-Wno-reserved-id-macro", "-fno-caret-diagnostics", "-fno-diagnostics-fixit-info", "-O1"]
+
+        if self.libclc_include_path is not None:
+            args.extend(["-I", self.libclc_include_path])
+
+        return args
+
+    def _get_clc_include_args(self, timeout):
+        # Parse the libclc headers only once per reduction
+        if self.pch_dir is not None and self.libclc_include_path is not None:
+            if self.clc_pch is None:
+                self.clc_pch = pch.get_clc_pch(self.clang, self._get_clang_args(), self.libclc_include_path, self.pch_dir, timeout)
+
+            if self.clc_pch is not None:
+                return ["-include-pch", self.clc_pch]
+
+        return ["-include", "clc/clc.h"]
+
+    def _get_clang_cmd(self, test_case, timeout, extra_args=None):
+        cmd = [self.clang]
+        cmd.extend(self._get_clang_args())
+        cmd.extend(self._get_clc_include_args(timeout))
+
+        if extra_args is not None:
+            cmd.extend(extra_args)
+
+        cmd.append(test_case)
+
+        return cmd
+
+    def is_statically_valid(self, test_case, timeout):
+        return self.get_static_rejection(test_case, timeout) is None
+
+    def get_static_rejection(self, test_case, timeout):
+        if self.result_cache is None:
+            return self._get_static_rejection(test_case, timeout)
+
+        # The backends do not necessarily agree on all test cases
+        if self.static_backend == "libclang" and libclang_backend.is_available(self.libclang):
+            backend = "libclang:{}".format(self.libclang)
+        else:
+            backend = "clang"
+
+        key = self.result_cache.get_key("static_rejection:{}:{}".format(self.libclc_include_path, backend), lexer.get_file_token_digest(test_case), [self.clang])
+        entry = self.result_cache.lookup(key)
+
+        if entry is not None:
+            return entry["rejection"]
+
+        rejection = self._get_static_rejection(test_case, timeout)
+        self.result_cache.store(key, {"rejection": rejection})
+
+        return rejection
+
+    def _get_static_rejection(self, test_case, timeout):
+        if self.static_backend == "libclang" and libclang_backend.is_available(self.libclang):
+            return self._get_libclang_static_rejection(test_case, timeout)
+
+        # The AST dump, the compilation and the static analyzer run
+        # concurrently. The compilation is still needed for the code generation
+        # as some variants only fail in the backend of clang.
+        with execution.ToolRunGroup() as group:
+            checks = {
+                self._start_tool(group, "clang ast", self._get_clang_cmd(test_case, timeout, ["-Xclang", "-ast-dump"]), timeout): static_checks.get_ast_rejection,
+                self._start_tool(group, "clang", self._get_clang_cmd(test_case, timeout), timeout): static_checks.get_clang_rejection,
+                self._start_tool(group, "clang static analyzer", self._get_clang_cmd(test_case, timeout, static_checks.CSA_ARGS), timeout): static_checks.get_csa_rejection,
+            }
+
+            for run in group.as_completed():
+                rejection = checks[run](run.result())
+
+                # Cancel the remaining checks as soon as one of them fails
+                if rejection is not None:
+                    return rejection
+
+        return None
+
+    def _get_libclang_static_rejection(self, test_case, timeout):
+        # libclang does not necessarily match the PCH built by self.clang
+        args = self._get_clang_args()
+        args.extend(["-include", "clc/clc.h"])
+
+        # libclang replaces the AST dump, the compilation still runs for the
+        # code generation next to the static analyzer
+        with execution.ToolRunGroup() as group:
+            checks = {
+                self._start_tool(group, "clang", self._get_clang_cmd(test_case, timeout), timeout): static_checks.get_clang_rejection,
+                self._start_tool(group, "clang static analyzer", self._get_clang_cmd(test_case, timeout, static_checks.CSA_ARGS), timeout): static_checks.get_csa_rejection,
+            }
+
+            rejection = libclang_backend.get_frontend_rejection(test_case, args, self.libclang)
+
+            if rejection is not None:
+                return rejection
+
+            for run in group.as_completed():
+                rejection = checks[run](run.result())
+
+                if rejection is not None:
+                    return rejection
+
+        return None
@@ -0,0 +1,64 @@
+from interestingness_tests import cache
+
+# Raised by a stage if the test case is not interesting (as opposed to invalid)
+class StageRejection(Exception):
+    pass
+
+class Stage:
+    def __init__(self, name, run, requires=()):
+        self.name = name
+        # Called with the outputs of the previous stages, rejects the test case
+        # by raising an exception
+        self.run = run
+        # Stages which have to pass before this stage may run, either because
+        # their output is needed or for safety
+        self.requires = tuple(requires)
+
+class StageStatistics:
+    def __init__(self, path):
+        self.connection = cache.connect(path)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS stages (test TEXT NOT NULL, stage TEXT NOT NULL, runs INTEGER NOT NULL, rejections INTEGER NOT NULL, runtime REAL NOT NULL, PRIMARY KEY (test, stage))")
+
+    def lookup(self, test):
+        rows = self.connection.execute("SELECT stage, runs, rejections, runtime FROM stages WHERE test = ?", (test,)).fetchall()
+
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def store(self, test, records):
+        with self.connection:
+            for (stage, rejected, runtime) in records:
+                self.connection.execute("INSERT OR IGNORE INTO stages (test, stage, runs, rejections, runtime) VALUES (?, ?, 0, 0, 0.0)", (test, stage))
+                self.connection.execute("UPDATE stages SET runs = runs + 1, rejections = rejections + ?, runtime = runtime + ? WHERE test = ? AND stage = ?", (int(rejected), runtime, test, stage))
+
+def get_rank(statistics):
+    # Stages which have never run are tried first to learn their cost
+    if statistics is None or statistics[0] == 0:
+        return 0.0
+
+    (runs, rejections, runtime) = statistics
+
+    # Laplace smoothing: no stage is assumed to never or always reject
+    probability = (rejections + 1) / (runs + 2)
+
+    return (runtime / runs) / probability
+
+def order_stages(stages, statistics):
+    # Independent filters are cheapest in ascending order of cost divided by
+    # rejection probability. Among the stages whose requirements are met the
+    # one with the lowest rank runs next, ties keep the given order.
+    names = set(stage.name for stage in stages)
+    remaining = list(stages)
+    ordered = []
+    done = set()
+
+    while remaining:
+        ready = [stage for stage in remaining if all(r in done or r not in names for r in stage.requires)]
+        stage = min(ready, key=lambda s: get_rank(statistics.get(s.name)))
+
+        remaining.remove(stage)
+        ordered.append(stage)
+        done.add(stage.name)
+
+    return ordered
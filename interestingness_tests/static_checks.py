@@ -0,0 +1,81 @@
+# Substrings in the output of clang which make a test case invalid
+AST_RULES = [
+    r"PointerToIntegral",
+]
+
+CLANG_RULES = [
+    r"warning: empty struct is a GNU extension",
+    r"warning: use of GNU empty initializer extension",
+    r"warning: incompatible pointer to integer conversion",
+    r"warning: incompatible integer to pointer conversion",
+    r"warning: incompatible pointer types initializing",
+    r"warning: comparison between pointer and integer",
+    r"warning: ordered comparison between pointer and integer",
+    r"warning: ordered comparison between pointer and zero",
+    r"is uninitialized when used within its own initialization [-Wuninitialized]",
+    r"is uninitialized when used here [-Wuninitialized]",
+    r"may be uninitialized when used here [-Wconditional-uninitialized]",
+    r"warning: use of GNU ?: conditional expression extension, omitting middle operand",
+    r"warning: control may reach end of non-void function [-Wreturn-type]",
+    r"warning: control reaches end of non-void function [-Wreturn-type]",
+    r"warning: zero size arrays are an extension [-Wzero-length-array]",
+    r"excess elements in ",
+    r"warning: address of stack memory associated with local variable",
+    r"warning: type specifier missing",
+    r"warning: expected ';' at end of declaration list",
+    r" declaration specifier [-Wduplicate-decl-specifier]",
+]
+
+CSA_RULES = [
+    "warning: Assigned value is garbage or undefined",
+    "warning: Undefined or garbage value returned to caller",
+    "is a garbage value",
+    "warning: Function call argument is an uninitialized value",
+    "warning: Dereference of null pointer",
+    "warning: Array subscript is undefined",
+    "results in a dereference of a null pointer",
+]
+
+CSA_ARGS = ["--analyze", "-Xclang", "-analyzer-checker", "-Xclang", "alpha,core,security,unix"]
+
+def find_rule(output, rules):
+    for rule in rules:
+        if rule in output:
+            return rule
+
+    return None
+
+# Each of the following returns a description of the rule which makes the test
+# case invalid or None if the test case is valid
+def get_ast_rejection(proc):
+    if proc is None or proc.returncode != 0:
+        return "ast: clang failed"
+
+    rule = find_rule(proc.stdout, AST_RULES)
+
+    if rule is not None:
+        return "ast: {}".format(rule)
+
+    return None
+
+def get_clang_rejection(proc):
+    if proc is None or proc.returncode != 0:
+        return "clang: clang failed"
+
+    rule = find_rule(proc.stderr, CLANG_RULES)
+
+    if rule is not None:
+        return "clang: {}".format(rule)
+
+    return None
+
+def get_csa_rejection(proc):
+    if proc is None or proc.returncode != 0:
+        return "csa: clang static analyzer failed"
+
+    rule = find_rule(proc.stderr, CSA_RULES)
+
+    if rule is not None:
+        return "csa: {}".format(rule)
+
+    return None
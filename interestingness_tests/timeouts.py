@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+
+class AdaptiveTimeouts:
+    def __init__(self, path, factor=5.0, floor=5.0):
+        self.path = path
+        self.factor = factor
+        self.floor = floor
+        self.baselines = self._load()
+        self.new_baselines = dict()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as baseline_file:
+                return json.load(baseline_file)
+        except (OSError, ValueError):
+            return dict()
+
+    def reload(self):
+        self.baselines = self._load()
+
+    def get_timeout(self, tool, ceiling):
+        # Tools without a baseline still get the full timeout
+        if tool not in self.baselines:
+            return ceiling
+
+        return min(ceiling, max(self.floor, self.factor * self.baselines[tool]))
+
+    def record(self, tool, runtime):
+        # The first runtime of a tool, i.e. the one of the original test case,
+        # becomes its baseline
+        if tool in self.baselines:
+            return
+
+        self.new_baselines[tool] = max(runtime, self.new_baselines.get(tool, 0.0))
+
+    def save(self):
+        if not self.new_baselines:
+            return
+
+        baselines = self._load()
+
+        for (tool, runtime) in self.new_baselines.items():
+            baselines.setdefault(tool, runtime)
+
+        (fd, tmp_path) = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(os.path.abspath(self.path)))
+
+        with os.fdopen(fd, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+
+        # Parallel interestingness tests might record baselines concurrently
+        os.replace(tmp_path, self.path)
+
+        self.baselines = baselines
+        self.new_baselines = dict()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+import uuid
+
+# Collects the spans of a single check and appends them to a JSONL file once
+# the check is finished
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.check_id = None
+        self.test_case = None
+        self.start = None
+        self.spans = []
+
+    def begin(self, test_cases):
+        self.check_id = uuid.uuid4().hex[:16]
+        self.test_case = os.path.basename(test_cases[0]) if test_cases else None
+        self.start = time.monotonic()
+        self.wall_start = time.time()
+        self.spans = []
+
+    def add_span(self, kind, name, start, end, **fields):
+        span = {
+            "check": self.check_id,
+            "test_case": self.test_case,
+            "kind": kind,
+            "name": name,
+            "offset": round(start - self.start, 6),
+            "duration": round(end - start, 6),
+        }
+        span.update(fields)
+        self.spans.append(span)
+
+    def end(self, verdict, reason=None, cached=False):
+        self.add_span("check", verdict, self.start, time.monotonic(), pid=os.getpid(), time=self.wall_start, reason=reason, cached=cached)
+
+        data = "".join(json.dumps(span, sort_keys=True) + "\n" for span in self.spans).encode()
+
+        # A single append so that parallel checks do not interleave their lines
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+        self.spans = []
+
+def read_spans(path):
+    with open(path, "r") as trace_file:
+        for line in trace_file:
+            line = line.strip()
+
+            if line:
+                yield json.loads(line)
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+def print_report(path, out=sys.stdout):
+    checks = collections.Counter()
+    cached_checks = 0
+    check_time = 0.0
+    stages = collections.OrderedDict()
+    tools = collections.OrderedDict()
+
+    for span in read_spans(path):
+        if span["kind"] == "check":
+            checks[span["name"]] += 1
+            check_time += span["duration"]
+
+            if span.get("cached"):
+                cached_checks += 1
+        elif span["kind"] == "stage":
+            stage = stages.setdefault(span["name"], {"runs": 0, "rejections": 0, "time": 0.0})
+            stage["runs"] += 1
+            stage["rejections"] += int(span.get("rejected", False))
+            stage["time"] += span["duration"]
+        elif span["kind"] == "tool":
+            tool = tools.setdefault(span["name"], {"runs": 0, "timeouts": 0, "cancelled": 0, "durations": [], "output": 0})
+            tool["runs"] += 1
+            tool["timeouts"] += int(span.get("timed_out", False))
+            tool["cancelled"] += int(span.get("cancelled", False))
+            tool["durations"].append(span["duration"])
+            tool["output"] += span.get("stdout_size", 0) + span.get("stderr_size", 0)
+
+    total = sum(checks.values())
+
+    print("Trace: {}".format(path), file=out)
+    print("Checks: {} ({} cached), {:.1f} s".format(total, cached_checks, check_time), file=out)
+
+    for (verdict, count) in checks.most_common():
+        print("  {:<16} {:>8}".format(verdict, count), file=out)
+
+    print("Stages:", file=out)
+    print("  {:<24} {:>8} {:>10} {:>10} {:>10}".format("stage", "runs", "rejected", "total s", "mean s"), file=out)
+
+    for (name, stage) in stages.items():
+        print("  {:<24} {:>8} {:>9.0%} {:>10.1f} {:>10.3f}".format(name, stage["runs"], stage["rejections"] / stage["runs"], stage["time"], stage["time"] / stage["runs"]), file=out)
+
+    print("Tools:", file=out)
+    print("  {:<28} {:>8} {:>8} {:>9} {:>10} {:>8} {:>8} {:>12}".format("tool", "runs", "timeouts", "cancelled", "total s", "p50 s", "max s", "mean output"), file=out)
+
+    for (name, tool) in tools.items():
+        durations = tool["durations"]
+        print("  {:<28} {:>8} {:>8} {:>9} {:>10.1f} {:>8.3f} {:>8.3f} {:>12.0f}".format(name, tool["runs"], tool["timeouts"], tool["cancelled"], sum(durations), get_percentile(durations, 50), max(durations), tool["output"] / tool["runs"]), file=out)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the traces of interestingness tests.")
+    parser.add_argument("traces", nargs="+", help="Trace files written by the interestingness tests (CREDUCE_TEST_TRACE)")
+
+    args = parser.parse_args()
+
+    for (i, path) in enumerate(args.traces):
+        if i > 0:
+            print()
+
+        print_report(path)
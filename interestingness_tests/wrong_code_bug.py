@@ -2,7 +2,10 @@
 
 from enum import Enum
 from interestingness_tests import base
+from interestingness_tests import execution
 from interestingness_tests import opencl
+from interestingness_tests import stages
+import collections
 import os
 import sys
 
@@ -37,6 +40,7 @@ class WrongCodeBugOpenCLInterestingnessTest(opencl.OpenCLInterestingnessTest):
         options["use_oracle"] = env.get("CREDUCE_TEST_USE_ORACLE")
         options["optimisation_level"] = env.get("CREDUCE_TEST_OPTIMISATION_LEVEL")
         options["check_static"] = env.get("CREDUCE_TEST_STATIC")
+        options["streaming_compare"] = env.get("CREDUCE_TEST_STREAMING_COMPARE")
 
         return options
 
@@ -58,88 +62,302 @@ class WrongCodeBugOpenCLInterestingnessTest(opencl.OpenCLInterestingnessTest):
         else:
             self.check_static = True
 
+        if "streaming_compare" in self.options and self.options["streaming_compare"] is not None:
+            self.streaming_compare = bool(int(self.options["streaming_compare"]))
+        else:
+            self.streaming_compare = False
+
+        # Runs of the last comparison with the device for each target and the
+        # output they were compared with, used to classify interesting test
+        # cases
+        self.device_runs = collections.OrderedDict()
+        self.reference_output = None
+
     def check(self):
+        check_stages = []
+
         if self.check_static:
-            if not self.is_valid_cl_launcher_test_case(self.test_case):
-                raise base.InvalidTestCaseError("cl_launcher")
+            check_stages.append(stages.Stage("cl_launcher", self._check_cl_launcher_test_case))
+            check_stages.append(stages.Stage("static", self._check_static))
+
+        if self.use_oracle and self.tiered_oracle:
+            # The output of Oclgrind without instrumentation is used to find
+            # uninteresting test cases, interesting ones are confirmed with
+            # the fully instrumented oracle
+            check_stages.append(stages.Stage("uninstrumented_oracle", self._check_uninstrumented_oracle))
+            check_stages.append(stages.Stage("device", self._check_device_against_uninstrumented_oracle, [s.name for s in check_stages]))
+            check_stages.append(stages.Stage("oracle", self._confirm_oracle, ["device"]))
+        elif self.use_oracle:
+            # Implicitly checks if test case is valid in Oclgrind
+            check_stages.append(stages.Stage("oracle", self._check_oracle))
+            check_stages.append(stages.Stage("device", self._check_device_against_oracle, [s.name for s in check_stages]))
+        else:
+            # Test cases which are invalid in Oclgrind must not run on the device
+            check_stages.append(stages.Stage("oclgrind", self._check_oclgrind))
+            check_stages.append(stages.Stage("device", self._check_device, [s.name for s in check_stages]))
 
-            if not self.is_statically_valid(self.test_case, self.timeout):
-                raise base.InvalidTestCaseError("static")
+        return self.run_stages(check_stages)
 
-        if self.use_oracle:
-            # Implicitly checks if test case is valid in Oclgrind
-            oracle = self.get_oracle_result(self.test_case, self.timeout)
+    def _check_cl_launcher_test_case(self, results):
+        if not self.is_valid_cl_launcher_test_case(self.test_case):
+            raise base.InvalidTestCaseError("cl_launcher")
+
+    def _check_static(self, results):
+        rejection = self.get_static_rejection(self.test_case, self.timeout)
+
+        if rejection is not None:
+            raise base.InvalidTestCaseError("static ({})".format(rejection))
+
+    def _check_oracle(self, results):
+        oracle = self.get_oracle_result(self.test_case, self.timeout)
+
+        if oracle is None:
+            raise base.InvalidTestCaseError("oracle")
 
-            if oracle is None:
-                raise base.InvalidTestCaseError("oracle")
+        return oracle
 
-            if self.optimisation_level is self.OptimisationLevel.optimised:
-                proc_opt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=True)
+    def _check_uninstrumented_oracle(self, results):
+        # Oclgrind fails with instrumentation as well if it fails without
+        oracle = self.get_oracle_result(self.test_case, self.timeout, instrumented=False)
 
-                if proc_opt is None or proc_opt.returncode != 0:
-                    raise base.InvalidTestCaseError("optimised")
+        if oracle is None:
+            raise base.InvalidTestCaseError("oracle")
 
-                return proc_opt.stdout != oracle
-            elif self.optimisation_level is self.OptimisationLevel.unoptimised:
-                proc_unopt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=False)
+        return oracle
 
-                if proc_unopt is None or proc_unopt.returncode != 0:
-                    raise base.InvalidTestCaseError("unoptimised")
+    def _check_device_against_uninstrumented_oracle(self, results):
+        if not self._compare_device_with_oracle(results["uninstrumented_oracle"]):
+            raise stages.StageRejection("device")
 
-                return proc_unopt.stdout != oracle
-            elif self.optimisation_level is self.OptimisationLevel.either:
-                proc_opt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=True)
+        return True
 
-                if proc_opt is None or proc_opt.returncode != 0:
-                    raise base.InvalidTestCaseError("optimised")
+    def _confirm_oracle(self, results):
+        oracle = self._check_oracle(results)
 
-                if proc_opt.stdout != oracle:
-                    return True
+        if oracle == results["uninstrumented_oracle"]:
+            return True
 
-                proc_unopt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=False)
+        # Only if the instrumentation changed the output the device runs have
+        # to be compared again
+        return self._compare_device_with_oracle(oracle)
 
-                if proc_unopt is None or proc_unopt.returncode != 0:
-                    raise base.InvalidTestCaseError("unoptimised")
+    def _check_device_against_oracle(self, results):
+        return self._compare_device_with_oracle(results["oracle"])
 
-                if proc_unopt.stdout != oracle:
-                    return True
+    def _start_device_runs(self, group, target, optimised=True, unoptimised=True, expected_stdout=None):
+        (platform, device) = target
+        name = self._get_cl_launcher_tool_name(target)
+        run_opt = None
+        run_unopt = None
 
-                return False
-            elif self.optimisation_level is self.OptimisationLevel.all:
-                proc_opt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=True)
+        if optimised:
+            run_opt = self._start_tool(group, name, self._get_cl_launcher_cmd(self.test_case, platform, device, optimised=True), self.timeout, expected_stdout=expected_stdout)
 
-                if proc_opt is None or proc_opt.returncode != 0:
-                    raise base.InvalidTestCaseError("optimised")
+        if unoptimised:
+            run_unopt = self._start_tool(group, name, self._get_cl_launcher_cmd(self.test_case, platform, device, optimised=False), self.timeout, expected_stdout=expected_stdout)
 
-                if proc_opt.stdout == oracle:
-                    return False
+        return (run_opt, run_unopt)
 
-                proc_unopt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=False)
+    # Settles the verdict for each target, the test case is interesting if it
+    # is interesting on any of them. Targets on which the test case fails only
+    # decide the verdict if it fails on all of them.
+    def _get_target_verdicts(self, evaluations):
+        self.target_verdicts = collections.OrderedDict()
+        result = None
+        error = None
 
-                if proc_unopt is None or proc_unopt.returncode != 0:
-                    raise base.InvalidTestCaseError("unoptimised")
+        for (target, evaluate) in evaluations:
+            name = self.get_target_name(target)
 
-                if proc_unopt.stdout == oracle:
-                    return False
+            try:
+                interesting = evaluate()
+            except base.TestTimeoutError as err:
+                self.target_verdicts[name] = "timeout ({})".format(err)
+                error = error or err
+                continue
+            except base.InvalidTestCaseError as err:
+                self.target_verdicts[name] = "failure ({})".format(err)
+                error = error or err
+                continue
 
-                return True
+            self.target_verdicts[name] = "different output" if interesting else "same output"
+            result = bool(result) or interesting
+
+        if result is None:
+            raise error
+
+        return result
+
+    def _compare_device_with_oracle(self, oracle):
+        # Streamed runs are killed as soon as their output differs, which
+        # needs the oracle in memory
+        expected_stdout = str(oracle) if self.streaming_compare else None
+
+        # The runs on all targets are started at once; runs which are not
+        # needed to settle the verdicts are cancelled when the group is left
+        with execution.ToolRunGroup() as group:
+            target_runs = [(target, self._start_device_runs(group, target,
+                                                            optimised=(self.optimisation_level is not self.OptimisationLevel.unoptimised),
+                                                            unoptimised=(self.optimisation_level is not self.OptimisationLevel.optimised),
+                                                            expected_stdout=expected_stdout))
+                           for target in self.targets]
+
+            self.device_runs = collections.OrderedDict(target_runs)
+            self.reference_output = oracle
+
+            levels = {}
+            outcomes = collections.OrderedDict((target, collections.OrderedDict()) for target in self.targets)
+            settled = {}
+
+            for (target, (run_opt, run_unopt)) in target_runs:
+                for (run, level) in ((run_opt, "optimised"), (run_unopt, "unoptimised")):
+                    if run is not None:
+                        levels[run] = (target, level)
+                        outcomes[target][level] = None
+
+            # The runs are evaluated in the order in which they finish and
+            # the remaining run of a target is cancelled once its verdict is
+            # settled
+            for run in group.as_completed():
+                (target, level) = levels[run]
+
+                if target in settled:
+                    continue
+
+                try:
+                    outcomes[target][level] = self._differs_from_oracle(run, oracle, level)
+                except (base.TestTimeoutError, base.InvalidTestCaseError) as err:
+                    outcomes[target][level] = err
+
+                try:
+                    verdict = self._settle_target_with_oracle(outcomes[target])
+                except (base.TestTimeoutError, base.InvalidTestCaseError) as err:
+                    verdict = err
+
+                if verdict is None:
+                    continue
+
+                settled[target] = verdict
+
+                for other in self.device_runs[target]:
+                    if other is not None and not other.done():
+                        other.cancel()
+
+                if len(settled) == len(self.targets):
+                    break
+
+            return self._get_target_verdicts([(target, lambda verdict=settled[target]: self._get_settled_verdict(verdict))
+                                              for target in self.targets])
+
+    # Verdict of a target from the outcomes of its finished runs (None for
+    # runs which are still running) or None if it is not settled yet. A run
+    # which differs (either) or does not differ (all) from the oracle settles
+    # the verdict even if the other run fails.
+    def _settle_target_with_oracle(self, outcomes):
+        if self.optimisation_level is self.OptimisationLevel.either:
+            decisive = True
+        elif self.optimisation_level is self.OptimisationLevel.all:
+            decisive = False
         else:
+            decisive = None
+
+        finished = [outcome for outcome in outcomes.values() if outcome is not None]
+
+        if decisive is not None and any(outcome is decisive for outcome in finished):
+            return decisive
+
+        if len(finished) < len(outcomes):
+            return None
+
+        for outcome in finished:
+            if isinstance(outcome, Exception):
+                raise outcome
+
+        return finished[0]
+
+    @staticmethod
+    def _get_settled_verdict(verdict):
+        if isinstance(verdict, Exception):
+            raise verdict
+
+        return verdict
+
+    def _differs_from_oracle(self, run, oracle, reason):
+        proc = run.result()
+
+        # A diverged run has been killed before it could finish
+        if run.diverged:
+            return True
+
+        if proc is None or proc.returncode != 0:
+            raise base.InvalidTestCaseError(reason)
+
+        return proc.stdout != oracle
+
+    # Outputs of the device runs of the last comparison for each target and
+    # optimisation level. Runs which have not been started, were cancelled or
+    # killed early are repeated. Failed runs give None.
+    def get_device_outputs(self):
+        outputs = collections.OrderedDict()
+
+        for (target, runs) in self.device_runs.items():
+            (platform, device) = target
+            target_outputs = collections.OrderedDict()
+
+            for (level, run, optimised) in (("optimised", runs[0], True), ("unoptimised", runs[1], False)):
+                try:
+                    if run is None or run.cancelled or run.diverged:
+                        proc = self._run_tool(self._get_cl_launcher_tool_name(target), self._get_cl_launcher_cmd(self.test_case, platform, device, optimised), self.timeout)
+                    else:
+                        proc = run.result()
+                except base.TestTimeoutError:
+                    proc = None
+
+                if proc is None or proc.returncode != 0:
+                    target_outputs[level] = None
+                else:
+                    target_outputs[level] = str(proc.stdout)
+
+            outputs[self.get_target_name(target)] = target_outputs
+
+        return outputs
+
+    def _check_oclgrind(self, results):
+        with execution.ToolRunGroup() as group:
             #FIXME: Need to run both?
-            if (not self.is_valid_oclgrind(self.test_case, self.timeout, optimised=True) or
-                not self.is_valid_oclgrind(self.test_case, self.timeout, optimised=False)):
-                return False
+            self._start_tool(group, "oclgrind", self._get_oclgrind_cmd(self.test_case, optimised=True), self.timeout)
+            self._start_tool(group, "oclgrind", self._get_oclgrind_cmd(self.test_case, optimised=False), self.timeout)
+
+            for run in group.as_completed():
+                proc = run.result()
+
+                if proc is None or proc.returncode != 0:
+                    raise stages.StageRejection("oclgrind")
+
+    def _check_device(self, results):
+        with execution.ToolRunGroup() as group:
+            target_runs = [(target, self._start_device_runs(group, target)) for target in self.targets]
+
+            # The unoptimised run is the reference
+            self.device_runs = collections.OrderedDict(target_runs)
+            self.reference_output = None
+
+            return self._get_target_verdicts([(target, lambda runs=runs: self._compare_target_runs(runs))
+                                              for (target, runs) in target_runs])
 
-            proc_opt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=True)
+    def _compare_target_runs(self, runs):
+        (run_opt, run_unopt) = runs
+        proc_opt = run_opt.result()
 
-            if proc_opt is None or proc_opt.returncode != 0:
-                raise base.InvalidTestCaseError("optimised")
+        if proc_opt is None or proc_opt.returncode != 0:
+            raise base.InvalidTestCaseError("optimised")
 
-            proc_unopt = self._run_cl_launcher(self.test_case, self.platform, self.device, self.timeout, optimised=False)
+        proc_unopt = run_unopt.result()
 
-            if proc_unopt is None or proc_unopt.returncode != 0:
-                raise base.InvalidTestCaseError("unoptimised")
+        if proc_unopt is None or proc_unopt.returncode != 0:
+            raise base.InvalidTestCaseError("unoptimised")
 
-            return proc_opt.stdout != proc_unopt.stdout
+        return proc_opt.stdout != proc_unopt.stdout
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -0,0 +1,158 @@
+from interestingness_tests import replay
+import collections
+import hashlib
+import json
+import math
+import os
+import re
+
+# Constructs which CLSmith only emits in the respective mode
+MODE_PATTERNS = collections.OrderedDict([
+    ("atomic_reductions", r"\bl_atomic_reduction\b"),
+    ("atomics", r"\batomic_(?:inc|dec|add|sub|xchg|cmpxchg|min|max|and|or|xor)\s*\("),
+    ("barriers", r"\bbarrier\s*\("),
+    ("divergence", r"\bget_linear_local_id\s*\("),
+    ("fake_divergence", r"\bFAKE_DIVERGE\b"),
+    ("group_divergence", r"\bget_linear_group_id\s*\("),
+    ("inter_thread_comm", r"\b[gl]_comm_values\b"),
+    ("vectors", r"\b(?:u?char|u?short|u?int|u?long)(?:2|3|4|8|16)\b"),
+])
+
+# Helpers of CLSmith.h which a preprocessed test case defines independently of
+# its modes
+HELPER_DEFINITION = r"\b\w+\s+get_linear_(?:global|local|group)_id\s*\(\s*(?:void)?\s*\)\s*(?:\{[^{}]*\}|;)"
+
+def get_modes(test_case):
+    with open(test_case, "r") as test_file:
+        content = re.sub(HELPER_DEFINITION, "", test_file.read())
+
+    return [mode for (mode, pattern) in MODE_PATTERNS.items() if re.search(pattern, content)]
+
+# Coarse description of how an output differs from the expected one, e.g. a
+# single wrong value or a missing part of the output
+def get_divergence(expected, actual):
+    if actual is None:
+        return "failure"
+
+    if expected is None:
+        return "unknown"
+
+    if actual == expected:
+        return "same"
+
+    expected_values = [v for v in re.split(r"[,\s]+", expected) if v]
+    actual_values = [v for v in re.split(r"[,\s]+", actual) if v]
+
+    if len(expected_values) != len(actual_values):
+        return "length"
+
+    different = sum(1 for (e, a) in zip(expected_values, actual_values) if e != a)
+
+    if different == 1:
+        return "one value"
+    elif different <= max(1, len(expected_values) // 10):
+        return "some values"
+    elif different < len(expected_values):
+        return "many values"
+    else:
+        return "all values"
+
+# Coarse size of the first difference in the dumped arrays relative to the
+# expected value
+def get_magnitude(expected, actual):
+    try:
+        (expected, actual) = (float(expected), float(actual))
+    except ValueError:
+        return "text"
+
+    if not (math.isfinite(expected) and math.isfinite(actual)):
+        return "non-finite"
+
+    error = abs(expected - actual) / abs(expected) if expected != 0 else math.inf
+
+    for (bound, name) in ((1e-3, "< 0.1%"), (1e-1, "< 10%"), (1.0, "< 100%")):
+        if error < bound:
+            return name
+
+    return ">= 100%"
+
+def get_array_signature(test, test_case):
+    # A verdict from the cache has not compared anything
+    if test.output_mismatch is None:
+        test.check()
+
+    mismatch = test.array_mismatch
+    signature = collections.OrderedDict([("output", test.output_mismatch)])
+
+    if test.output_mismatch == "arrays" and mismatch is not None:
+        signature["array"] = mismatch.array
+        signature["difference"] = "length" if "<end of line>" in (mismatch.expected, mismatch.actual) else "values"
+
+        if signature["difference"] == "values":
+            signature["magnitude"] = get_magnitude(mismatch.expected, mismatch.actual)
+    elif test.output_mismatch != "stdout":
+        # numdiff does not tell where the arrays differ and a flaky test case
+        # might not differ anymore, such test cases form their own clusters
+        signature["test_case"] = replay.get_file_digest(test_case)
+
+    return signature
+
+def get_signature(test, test_case, modes=None):
+    signature = collections.OrderedDict()
+
+    if hasattr(test, "get_device_outputs"):
+        # A verdict from the cache has not run anything, the results of the
+        # static checks and of the oracle are cached as well
+        if not test.device_runs:
+            test.check()
+
+        targets = collections.OrderedDict()
+
+        for (target, outputs) in test.get_device_outputs().items():
+            if test.reference_output is not None:
+                targets[target] = collections.OrderedDict((level, get_divergence(str(test.reference_output), output)) for (level, output) in outputs.items())
+            else:
+                # Without oracle the optimised output is compared with the
+                # unoptimised one
+                targets[target] = {"optimised": get_divergence(outputs["unoptimised"], outputs["optimised"])}
+
+        signature["targets"] = targets
+        signature["modes"] = sorted(modes) if modes is not None else get_modes(test_case)
+    elif hasattr(test, "output_mismatch"):
+        # PPCG kernels are not generated by CLSmith and have no modes
+        signature.update(get_array_signature(test, test_case))
+    else:
+        signature["test_case"] = replay.get_file_digest(test_case)
+
+    return signature
+
+def get_cluster_id(signature):
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode()).hexdigest()[:12]
+
+# Groups the interesting test cases by their signatures. The smallest test case
+# of each cluster is its representative, clusters are ordered by the size of
+# their representatives.
+def get_clusters(records):
+    clusters = collections.OrderedDict()
+
+    for record in records:
+        clusters.setdefault(get_cluster_id(record["signature"]), []).append(record)
+
+    for members in clusters.values():
+        members.sort(key=lambda r: (os.path.getsize(r["path"]), r["name"]))
+
+    return sorted(clusters.items(), key=lambda c: (os.path.getsize(c[1][0]["path"]), c[1][0]["name"]))
+
+def write_clusters(path, clusters):
+    data = []
+
+    for (cluster_id, members) in clusters:
+        data.append({
+            "cluster": cluster_id,
+            "signature": members[0]["signature"],
+            "representative": members[0]["name"],
+            "members": [member["name"] for member in members],
+        })
+
+    with open(path, "w") as clusters_file:
+        json.dump(data, clusters_file, indent=2)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import argparse
+from interestingness_tests import cache
+import json
+import re
+import sqlite3
+import sys
+import time
+
+# Columns of the index besides the path of the original test case. Modes and
+# work sizes are comma separated, e.g. "barriers,vectors" and "256,1,1".
+COLUMNS = [
+    ("name", "TEXT"),
+    ("digest", "TEXT"),
+    ("size", "INTEGER"),
+    ("modes", "TEXT"),
+    ("duplicate_of", "TEXT"),
+    ("global_work_size", "TEXT"),
+    ("local_work_size", "TEXT"),
+    ("test", "TEXT"),
+    ("device", "TEXT"),
+    ("verdict", "TEXT"),
+    ("reason", "TEXT"),
+    ("signature", "TEXT"),
+    ("reduction_runtime", "REAL"),
+    ("reduced_size", "INTEGER"),
+    ("updated", "REAL"),
+]
+
+# Results of the stages which are stale once the content of a test case changes
+RESULT_COLUMNS = ["duplicate_of", "global_work_size", "local_work_size", "test", "device", "verdict", "reason", "signature", "reduction_runtime", "reduced_size"]
+
+def get_work_sizes(test_case):
+    with open(test_case, "r") as test_file:
+        match = re.search(r"-g ([0-9]+(?:,[0-9]+)*) -l ([0-9]+(?:,[0-9]+)*)", test_file.readline())
+
+    if match is None:
+        return (None, None)
+
+    return (match.group(1), match.group(2))
+
+# One row per test case, keyed by the path of the original test case, with the
+# results of all stages it went through. Several runs and parallel jobs share
+# the same index.
+class CorpusIndex:
+    def __init__(self, path):
+        self.connection = cache.connect(path)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS test_cases (path TEXT PRIMARY KEY, {})".format(", ".join("{} {}".format(c, t) for (c, t) in COLUMNS)))
+
+    # Adds a test case or resets its results if its content has changed
+    def register(self, path, name, digest, size, modes):
+        with self.connection:
+            row = self.connection.execute("SELECT digest FROM test_cases WHERE path = ?", (path,)).fetchone()
+
+            if row is None:
+                self.connection.execute("INSERT INTO test_cases (path, name, digest, size, modes, updated) VALUES (?, ?, ?, ?, ?, ?)", (path, name, digest, size, modes, time.time()))
+            elif row["digest"] != digest:
+                assignments = ", ".join("{} = NULL".format(c) for c in RESULT_COLUMNS)
+                self.connection.execute("UPDATE test_cases SET name = ?, digest = ?, size = ?, modes = ?, updated = ?, {} WHERE path = ?".format(assignments), (name, digest, size, modes, time.time(), path))
+
+    def update(self, path, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join("{} = ?".format(c) for c in fields)
+
+        with self.connection:
+            self.connection.execute("UPDATE test_cases SET {} WHERE path = ?".format(assignments), list(fields.values()) + [path])
+
+    def get(self, path):
+        return self.connection.execute("SELECT * FROM test_cases WHERE path = ?", (path,)).fetchone()
+
+    # Whether the row of the test case satisfies the SQL expression
+    def matches(self, path, predicate):
+        return self.connection.execute("SELECT 1 FROM test_cases WHERE path = ? AND ({})".format(predicate), (path,)).fetchone() is not None
+
+    def query(self, predicate=None, columns=None, order=None):
+        sql = "SELECT {} FROM test_cases".format(", ".join(columns) if columns else "*")
+
+        if predicate is not None:
+            sql += " WHERE {}".format(predicate)
+
+        sql += " ORDER BY {}".format(order if order is not None else "path")
+
+        return self.connection.execute(sql).fetchall()
+
+    # Raises sqlite3.Error if the expression is not a valid predicate
+    def validate(self, predicate):
+        self.connection.execute("SELECT 1 FROM test_cases WHERE ({}) LIMIT 0".format(predicate))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the corpus index of reduction_helper.py.")
+    parser.add_argument("index", help="Corpus index (reduction_helper.py --corpus-db)")
+    parser.add_argument("--where", help="SQL expression the test cases have to satisfy, e.g. \"verdict = 'interesting' AND modes LIKE '%%barriers%%'\"")
+    parser.add_argument("--columns", help="Comma separated list of columns (default: all)")
+    parser.add_argument("--order", help="SQL ordering of the test cases (default: path)")
+    parser.add_argument("--json", action="store_true", help="Print the test cases as JSON")
+    parser.add_argument("--count", action="store_true", help="Only print the number of test cases")
+
+    args = parser.parse_args()
+
+    columns = [c.strip() for c in args.columns.split(",")] if args.columns else None
+
+    try:
+        rows = CorpusIndex(args.index).query(args.where, columns, args.order)
+    except sqlite3.Error as err:
+        print("Invalid query: {}".format(err))
+        sys.exit(1)
+
+    if args.count:
+        print(len(rows))
+    elif args.json:
+        json.dump([dict(row) for row in rows], sys.stdout, indent=2)
+        print()
+    else:
+        for row in rows:
+            print("\t".join("" if v is None else str(v) for v in row))
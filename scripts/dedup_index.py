@@ -0,0 +1,35 @@
+from interestingness_tests import cache
+from interestingness_tests import lexer
+import os
+
+# Persistent index of the token digests of all test cases seen so far. Test
+# cases which only differ in their formatting or comments map to the same
+# digest and are only processed once, also across several runs.
+class DedupIndex:
+    source = "source"
+    preprocessed = "preprocessed"
+
+    def __init__(self, path):
+        self.connection = cache.connect(path)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS test_cases (stage TEXT NOT NULL, digest TEXT NOT NULL, path TEXT NOT NULL, PRIMARY KEY (stage, digest))")
+
+    # Returns the path of the test case which has been seen first with the same
+    # content or None if the test case is not a duplicate. Preprocessed test
+    # cases are identified by the test case they originate from.
+    def get_original(self, stage, test_case, origin=None):
+        digest = lexer.get_file_token_digest(test_case)
+        path = os.path.abspath(origin if origin is not None else test_case)
+
+        # Parallel jobs might add the same digest at once, the first one wins
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO test_cases (stage, digest, path) VALUES (?, ?, ?)", (stage, digest, path))
+
+        (original,) = self.connection.execute("SELECT path FROM test_cases WHERE stage = ? AND digest = ?", (stage, digest)).fetchone()
+
+        # Running the same test case again is not a duplicate
+        if original == path:
+            return None
+
+        return original
@@ -2,16 +2,27 @@
 
 import argparse
 import atexit
-import fileinput
+import bug_signature
+import collections
+import concurrent.futures
+import corpus_index
+import dedup_index
 import interestingness_tests
+import interestingness_tests.replay
+import interestingness_tests.trace
+import io
+import json
+import multiprocessing
 import os
 import pathlib
 import platform
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import work_size_reduction
 
@@ -32,12 +43,40 @@ def which(cmd):
 
     return None
 
-def remove_preprocessor_comments(test_case_name):
-    for line in fileinput.input(test_case_name, inplace=True):
-        if re.match(r'^# \d+ "[^"]*"', line):
-            continue
+line_marker_regex = re.compile(r'# \d+ "[^"]*"')
 
-        print(line, end="")
+def preprocess_test_case(clang, cl_smith_path, test_case_path, output_path, timeout):
+    cmd = [clang]
+    cmd.extend(["-I", cl_smith_path, "-E", "-CC", test_case_path])
+
+    # Drop the line markers while the output of clang is streamed into the file
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True) as proc:
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+
+        try:
+            with open(output_path, "w") as output_file:
+                for line in proc.stdout:
+                    if line_marker_regex.match(line):
+                        continue
+
+                    output_file.write(line)
+        finally:
+            timer.cancel()
+
+    if proc.returncode != 0:
+        os.remove(output_path)
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
 def get_test_class(test_str):
     if test_str is None:
@@ -52,6 +91,32 @@ def get_test_class(test_str):
         print("Unknown interestingness test")
         sys.exit(1)
 
+def start_test_daemon(test_str, env):
+    daemon_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(daemon_dir, "test.sock")
+    daemon_script = os.path.join(os.path.dirname(interestingness_tests.__file__), "daemon.py")
+
+    daemon = subprocess.Popen([sys.executable, daemon_script, "--test", test_str, "--socket", socket_path], env=env)
+
+    # Wait until the daemon accepts connections
+    start = time.monotonic()
+
+    while not os.path.exists(socket_path):
+        if daemon.poll() is not None or time.monotonic() - start > 60:
+            stop_test_daemon(daemon, daemon_dir)
+            return (None, None, None)
+
+        time.sleep(0.1)
+
+    return (daemon, daemon_dir, socket_path)
+
+def stop_test_daemon(daemon, daemon_dir):
+    if daemon.poll() is None:
+        daemon.terminate()
+        daemon.wait()
+
+    shutil.rmtree(daemon_dir, ignore_errors=True)
+
 def get_test_script_file(test_str):
     if test_str is None:
         print("Missing --test argument")
@@ -65,6 +130,482 @@ def get_test_script_file(test_str):
         print("Unknown interestingness test")
         sys.exit(1)
 
+def generate_test_case(cl_smith_tool, modes, seed, test_case_path, sandbox_root):
+    # CLSmith always writes CLProg.c into the current directory
+    sandbox_dir = tempfile.mkdtemp(prefix="sandbox.", dir=sandbox_root)
+
+    try:
+        cmd = [cl_smith_tool]
+
+        if modes:
+            cmd.extend(["--" + mode for mode in modes])
+
+        if seed is not None:
+            cmd.extend(["--seed", str(seed)])
+
+        subprocess.run(cmd, timeout=60, check=True, cwd=sandbox_dir)
+        shutil.move(os.path.join(sandbox_dir, "CLProg.c"), test_case_path)
+    except (subprocess.SubprocessError, OSError):
+        return False
+    finally:
+        shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+    return True
+
+def generate_test_cases(test_cases, args, cl_smith_tool, sandbox_root):
+    # Yields the test cases in order as soon as they are generated while a
+    # limited number of test cases is generated ahead in parallel
+    with concurrent.futures.ThreadPoolExecutor(args.generate_jobs) as executor:
+        pending = collections.deque()
+
+        for (i, test_case) in enumerate(test_cases):
+            if args.seed is not None:
+                seed = args.seed + i
+            else:
+                seed = None
+
+            future = executor.submit(generate_test_case, cl_smith_tool, args.modes, seed, test_case, sandbox_root)
+            pending.append((test_case, seed, future))
+
+            if len(pending) > 2 * args.generate_jobs:
+                (test_case, seed, future) = pending.popleft()
+                yield (test_case, seed, future.result())
+
+        while pending:
+            (test_case, seed, future) = pending.popleft()
+            yield (test_case, seed, future.result())
+
+# Pool.imap consumes its input eagerly from a separate thread, which would
+# generate all test cases at once. Every job has to be released once its result
+# has been consumed before another one is submitted.
+def get_bounded_jobs(jobs, semaphore):
+    for job in jobs:
+        semaphore.acquire()
+        yield job
+
+def format_target_verdicts(test):
+    # Only tests with several targets have a verdict matrix
+    target_verdicts = getattr(test, "target_verdicts", {})
+
+    if len(target_verdicts) <= 1:
+        return ""
+
+    return " [{}]".format(", ".join("{}: {}".format(target, verdict) for (target, verdict) in target_verdicts.items()))
+
+# Variables which belong to a single test case
+TEST_CASE_ENVIRONMENT = ["CREDUCE_TEST_ADAPTIVE_TIMEOUT", "CREDUCE_TEST_STAGE_STATS", "CREDUCE_TEST_TRACE"]
+
+def clear_test_case_environment(args):
+    # Only the variables set by this script are removed, not those set by the
+    # user for all test cases
+    for (name, enabled) in zip(TEST_CASE_ENVIRONMENT, [args.adaptive_timeouts, args.adaptive_stage_order, args.trace]):
+        if enabled:
+            os.environ.pop(name, None)
+
+def set_test_case_environment(test_case_name, args):
+    # The first check of a test case records the runtimes of the programs
+    if args.adaptive_timeouts:
+        os.environ["CREDUCE_TEST_ADAPTIVE_TIMEOUT"] = os.path.abspath("{}.timeouts.json".format(test_case_name))
+
+    # Every reduction learns its own stage order
+    if args.adaptive_stage_order:
+        os.environ["CREDUCE_TEST_STAGE_STATS"] = os.path.abspath("{}.stages.sqlite".format(test_case_name))
+
+    # All checks of a test case, including its reduction, share one trace
+    if args.trace:
+        os.environ["CREDUCE_TEST_TRACE"] = os.path.abspath("{}.trace.jsonl".format(test_case_name))
+
+# Log messages of the verdicts in the corpus index
+INDEXED_VERDICTS = {"uninteresting": "same output", "timeout": "timeout", "invalid": "failure"}
+
+def get_device():
+    targets = os.environ.get("CREDUCE_TEST_TARGETS")
+
+    if targets is not None:
+        return targets
+
+    return "{}:{}".format(os.environ.get("CREDUCE_TEST_PLATFORM"), os.environ.get("CREDUCE_TEST_DEVICE"))
+
+def is_skipped(corpus, stage, source, args):
+    if corpus is None or stage not in args.skip_if:
+        return False
+
+    return corpus.matches(source, args.skip_if[stage])
+
+def process_test_case(test_case, seed, generated, args, config, log_file):
+    cl_smith_path = config["cl_smith_path"]
+    clang = config["clang"]
+    corpus = corpus_index.CorpusIndex(args.corpus_db) if args.corpus_db else None
+
+    test_case_path = test_case
+    (test_case_name, _) = os.path.splitext(os.path.basename(test_case))
+
+    print(os.path.basename(test_case_path), end=" ", flush=True, file=log_file)
+
+    # The work size reduction must neither use the files of the previous test
+    # case nor record the runtimes of its own variants as baselines
+    clear_test_case_environment(args)
+
+    # Generate test case if desired
+    if args.generate:
+        if not generated:
+            print("-> aborted generation", file=log_file)
+            return
+
+        if args.verbose:
+            if seed is not None:
+                print("-> generated (seed {})".format(seed), end=" ", flush=True, file=log_file)
+            else:
+                print("-> generated", end=" ", flush=True, file=log_file)
+
+    # Check if file exists
+    if not os.path.isfile(test_case_path):
+        print("-> not found", file=log_file)
+        return
+
+    # The index and the signature take the modes from the source, the
+    # preprocessed test case contains CLSmith.h
+    modes = get_modes(test_case_path, args)
+
+    if corpus is not None:
+        corpus.register(test_case, test_case_name, interestingness_tests.replay.get_file_digest(test_case_path), os.path.getsize(test_case_path), ",".join(sorted(modes)))
+
+        if is_skipped(corpus, "all", test_case, args):
+            print("-> skipped", file=log_file)
+            return
+
+    # Skip test cases which have been seen before
+    if args.dedup_index:
+        index = dedup_index.DedupIndex(args.dedup_index)
+        original = index.get_original(index.source, test_case_path)
+
+        if original is not None:
+            print("-> duplicate of {}".format(os.path.basename(original)), file=log_file)
+
+            if corpus is not None:
+                corpus.update(test_case, duplicate_of=original)
+
+            return
+
+    # Preprocess test case if desired
+    if args.preprocess:
+        try:
+            preprocess_test_case(clang, cl_smith_path, test_case_path, "{}.pre.cl".format(test_case_name), 60)
+            test_case_path = os.path.abspath("{}.pre.cl".format(test_case_name))
+
+            if args.verbose:
+                print("-> preprocessed", end=" ", flush=True, file=log_file)
+        except subprocess.SubprocessError:
+            print("-> aborted preprocessing", file=log_file)
+            return
+
+        # Different sources, e.g. with different include paths, might result
+        # in the same preprocessed test case
+        if args.dedup_index:
+            original = index.get_original(index.preprocessed, test_case_path, test_case)
+
+            if original is not None:
+                print("-> duplicate of {}".format(os.path.basename(original)), file=log_file)
+
+                if corpus is not None:
+                    corpus.update(test_case, duplicate_of=original)
+
+                return
+
+    # Reduce work sizes of the test case
+    if args.reduce_work_sizes:
+        shutil.copy(test_case_path, "{}.rws.cl".format(test_case_name))
+        test_case_path = os.path.abspath("{}.rws.cl".format(test_case_name))
+
+        if args.reduce_work_sizes == 1:
+            test_class = get_test_class(args.test)
+            options = test_class.get_test_options(os.environ)
+        else:
+            test_class = None
+            options = None
+
+        reducer = work_size_reduction.WorkSizeReducer(test_case_path, test_class, options, args.work_size_budget, args.work_size_jobs)
+        success = reducer.run(checked=(args.reduce_work_sizes == 1))
+
+        if args.verbose:
+            if success:
+                print("-> work sizes reduced", end=" ", flush=True, file=log_file)
+            else:
+                print("-> work sizes unchanged", end=" ", flush=True, file=log_file)
+
+    if corpus is not None:
+        (global_work_size, local_work_size) = corpus_index.get_work_sizes(test_case_path)
+        corpus.update(test_case, global_work_size=global_work_size, local_work_size=local_work_size)
+
+    set_test_case_environment(test_case_name, args)
+    checked = False
+
+    # Reuse the indexed verdict instead of checking the test case again
+    if args.check and is_skipped(corpus, "check", test_case, args):
+        row = corpus.get(test_case)
+
+        if row["verdict"] is None or args.cluster is not None and row["verdict"] == "interesting" and row["signature"] is None:
+            print("-> not indexed", end=" ", flush=True, file=log_file)
+        elif row["verdict"] != "interesting":
+            print("-> {} (indexed)".format(INDEXED_VERDICTS[row["verdict"]]), file=log_file)
+            return
+        else:
+            shutil.copy(test_case_path, "{}.chk.cl".format(test_case_name))
+            test_case_path = os.path.abspath("{}.chk.cl".format(test_case_name))
+            print("-> different output (indexed)", end=" ", flush=True, file=log_file)
+
+            if args.cluster is not None:
+                signature = json.loads(row["signature"])
+                print("-> cluster {}".format(bug_signature.get_cluster_id(signature)), end=" ", flush=True, file=log_file)
+
+            checked = True
+
+    # Check if test case is interesting
+    if args.check and not checked:
+        test_class = get_test_class(args.test)
+        myenv = os.environ
+        myenv['CREDUCE_PPCG_HOST_EXEC_DIR'] = os.path.dirname(test_case_path)
+        options = test_class.get_test_options(myenv)
+        tmp_dir = tempfile.mkdtemp()
+        out_dir = os.getcwd()
+        os.chdir(tmp_dir)
+        test_case_file = os.path.basename(test_case_path)
+
+        shutil.copy(test_case_path, test_case_file)
+        test = test_class([test_case_file], options)
+
+        try:
+            stop = False
+            signature = None
+            result = test.check_cached()
+            reason = format_target_verdicts(test).strip(" []") or None
+
+            if not result:
+                print("-> same output{}".format(format_target_verdicts(test)), file=log_file)
+                verdict = "uninteresting"
+                stop = True
+            else:
+                verdict = "interesting"
+
+                if args.cluster is not None:
+                    signature = get_signature(test, test_case_file, test_case_name, modes)
+        except interestingness_tests.TestTimeoutError as err:
+            print("-> timeout ({})".format(err), file=log_file)
+            (verdict, reason) = ("timeout", str(err))
+            stop = True
+        except interestingness_tests.InvalidTestCaseError as err:
+            print("-> failure ({})".format(err), file=log_file)
+            (verdict, reason) = ("invalid", str(err))
+            stop = True
+        finally:
+            os.chdir(out_dir)
+
+            try:
+                shutil.rmtree(tmp_dir)
+            except OSError:
+                pass
+
+        if corpus is not None:
+            corpus.update(test_case, test=args.test, device=get_device(), verdict=verdict, reason=reason, signature=json.dumps(signature) if signature is not None else None)
+
+        if stop:
+            return
+        else:
+            shutil.copy(test_case_path, "{}.chk.cl".format(test_case_name))
+            test_case_path = os.path.abspath("{}.chk.cl".format(test_case_name))
+            print("-> different output{}".format(format_target_verdicts(test)), end=" ", flush=True, file=log_file)
+
+            # Only known if the arrays have been compared in this run
+            if args.verbose and getattr(test, "array_mismatch", None) is not None:
+                print("({})".format(test.array_mismatch), end=" ", flush=True, file=log_file)
+
+            if args.cluster is not None:
+                print("-> cluster {}".format(bug_signature.get_cluster_id(signature)), end=" ", flush=True, file=log_file)
+
+    # Test cases are reduced after all of them have been clustered
+    if args.reduce and args.cluster is not None:
+        print("-> done", file=log_file)
+
+        return {"name": test_case_name, "path": test_case_path, "source": test_case, "signature": signature}
+
+    if args.reduce and is_skipped(corpus, "reduce", test_case, args):
+        print("-> reduction skipped", end=" ", flush=True, file=log_file)
+    elif args.reduce:
+        if not reduce_test_case(test_case_path, test_case_name, test_case, args, config, log_file):
+            return
+
+    print("-> done", file=log_file)
+
+def reduce_test_case(test_case_path, test_case_name, source, args, config, log_file):
+    # Files with fixed names, e.g. the C-Reduce test wrapper, are created here
+    scratch_dir = config["scratch_dir"]
+
+    shutil.copy(test_case_path, "{}.cl".format(test_case_name))
+    host_exec_dir = os.path.dirname(test_case_path)
+    test_case_path = os.path.abspath("{}.cl".format(test_case_name))
+
+    reduction_env = os.environ
+    reduction_env['CREDUCE_PPCG_HOST_EXEC_DIR'] = host_exec_dir
+    reduction_env["CREDUCE_TEST_CASE"] = os.path.basename(test_case_path)
+
+    test_script_file = get_test_script_file(args.test)
+    daemon = None
+
+    if args.daemon and sys.platform != "win32":
+        (daemon, daemon_dir, socket_path) = start_test_daemon(args.test, reduction_env)
+
+        if daemon is None:
+            print("-> daemon failed", end=" ", flush=True, file=log_file)
+
+    # Create test case wrapper
+    #FIXME: Call python script directly?
+    if daemon is not None:
+        reduction_env["CREDUCE_TEST_DAEMON_SOCKET"] = socket_path
+        test_wrapper = os.path.join(scratch_dir, "test_wrapper.sh")
+        client_script_file = os.path.join(os.path.dirname(interestingness_tests.__file__), "client.py")
+
+        with open(test_wrapper, "w") as test_file:
+            test_file.write("#!/bin/bash\n")
+            test_file.write("exec python3 -S {}\n".format(client_script_file))
+
+        os.chmod(test_wrapper, 0o744)
+    elif sys.platform == "win32":
+        test_wrapper = os.path.join(scratch_dir, "test_wrapper.bat")
+
+        with open(test_wrapper, "w") as test_file:
+            test_file.write("python {}\n".format(test_script_file))
+
+        os.chmod(test_wrapper, 0o744)
+    else:
+        test_wrapper = os.path.join(scratch_dir, "test_wrapper.sh")
+
+        with open(test_wrapper, "w") as test_file:
+            test_file.write("#!/bin/bash\n")
+            test_file.write("exec python3 {}\n".format(test_script_file))
+
+        os.chmod(test_wrapper, 0o744)
+
+    cmd = ["perl"]
+    cmd.extend(["--", which("creduce")])
+
+    if args.n:
+        cmd.extend(["--n", str(args.n)])
+
+    if args.verbose:
+        cmd.append("--debug")
+
+    cmd.append("--timing")
+    cmd.append(test_wrapper)
+    cmd.append(test_case_path)
+
+    with open("{}.log".format(test_case_name), mode="w") as log:
+        try:
+            stop = False
+            size_before = os.path.getsize(test_case_path)
+            start = time.monotonic()
+            proc = subprocess.run(cmd, env=reduction_env, stdout=log, stderr=subprocess.STDOUT, universal_newlines=True)
+        except subprocess.SubprocessError:
+            print("-> reduction aborted", file=log_file)
+            stop = True
+        finally:
+            runtime = time.monotonic() - start
+            log.write("\nRuntime: {} seconds\n".format(round(runtime, 0)))
+
+            if daemon is not None:
+                stop_test_daemon(daemon, daemon_dir)
+                del reduction_env["CREDUCE_TEST_DAEMON_SOCKET"]
+
+            size_after = os.path.getsize(test_case_path)
+
+            if size_before == size_after:
+                try:
+                    os.remove(test_case_path)
+                except OSError:
+                    pass
+
+    trace_path = os.path.abspath("{}.trace.jsonl".format(test_case_name))
+
+    if args.trace and os.path.isfile(trace_path):
+        with open("{}.trace.txt".format(test_case_name), "w") as report_file:
+            interestingness_tests.trace.print_report(trace_path, report_file)
+
+    if stop:
+        return False
+    else:
+        if args.corpus_db:
+            corpus_index.CorpusIndex(args.corpus_db).update(source, reduction_runtime=round(runtime, 1), reduced_size=size_after)
+
+        if args.verbose:
+            print("-> reduced", file=log_file)
+
+    return True
+
+def get_modes(test_case, args):
+    # Modes of generated test cases are known
+    if args.generate and args.modes:
+        return args.modes
+
+    return bug_signature.get_modes(test_case)
+
+def get_signature(test, test_case_file, test_case_name, modes):
+    try:
+        return bug_signature.get_signature(test, test_case_file, modes)
+    except (interestingness_tests.TestTimeoutError, interestingness_tests.InvalidTestCaseError):
+        # Test cases which cannot be classified form their own cluster
+        return {"test_case": test_case_name}
+
+def init_job(args, config, scratch_root):
+    global job_args
+    global job_config
+
+    job_args = args
+    job_config = dict(config)
+    job_config["scratch_dir"] = tempfile.mkdtemp(prefix="worker.", dir=scratch_root)
+
+def run_job(job):
+    (test_case, seed, generated) = job
+
+    # Buffer the log so that the lines of different test cases do not interleave
+    log = io.StringIO()
+    record = process_test_case(test_case, seed, generated, job_args, job_config, log)
+
+    return (log.getvalue(), record)
+
+def run_reduce_job(job):
+    (record, cluster_id) = job
+
+    log = io.StringIO()
+    reduce_clustered_test_case(record, cluster_id, job_args, job_config, log)
+
+    return log.getvalue()
+
+def reduce_clustered_test_case(record, cluster_id, args, config, log_file):
+    print("{} -> cluster {}".format(os.path.basename(record["path"]), cluster_id), end=" ", flush=True, file=log_file)
+
+    set_test_case_environment(record["name"], args)
+
+    if args.corpus_db and is_skipped(corpus_index.CorpusIndex(args.corpus_db), "reduce", record["source"], args):
+        print("-> reduction skipped -> done", file=log_file)
+    elif reduce_test_case(record["path"], record["name"], record["source"], args, config, log_file):
+        print("-> done", file=log_file)
+
+# Representatives of all clusters are reduced first, the remaining test cases
+# of the clusters afterwards or not at all
+def get_reduction_order(clusters, args, log_file):
+    representatives = []
+    duplicates = []
+
+    for (cluster_id, members) in clusters:
+        representatives.append((members[0], cluster_id))
+
+        for member in members[1:]:
+            if args.cluster == "skip":
+                print("{} -> duplicate of {} (skipped)".format(os.path.basename(member["path"]), members[0]["name"]), file=log_file)
+            else:
+                duplicates.append((member, cluster_id))
+
+    return representatives + duplicates
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Script to manage the reduction process of OpenCL test cases from generation to the reduced output.")
     inputGroup = parser.add_mutually_exclusive_group(required=True)
@@ -75,6 +616,10 @@ if __name__ == "__main__":
 
     parser.add_argument("--exclude-file", dest="exclude_file", help="File containing a list of test cases that should be ignored")
     parser.add_argument("-n", metavar="NUM", type=int, help="Number of parallel interestingness tests per test case")
+    parser.add_argument("--jobs", "-j", metavar="NUM", type=int, default=1, help="Number of test cases processed in parallel")
+    parser.add_argument("--generate-jobs", dest="generate_jobs", metavar="NUM", type=int, help="Number of test cases generated in parallel (default: --jobs)")
+    parser.add_argument("--seed", metavar="SEED", type=int, help="Generate the i-th test case with the CLSmith seed SEED + i")
+    parser.add_argument("--max-cores", dest="max_cores", metavar="NUM", type=int, help="Maximum number of cores shared by the parallel test cases and their reductions")
 
     processGroup = parser.add_mutually_exclusive_group()
     processGroup.add_argument("--preprocess", action="store_true", help="Preprocess test cases")
@@ -86,12 +631,28 @@ if __name__ == "__main__":
     reduceGroup.add_argument("--reduce-work-sizes-checked", dest="reduce_work_sizes", action="store_const", const=1, help="Reduce dimensions of the test cases")
     reduceGroup.add_argument("--reduce-work-sizes-unchecked", dest="reduce_work_sizes", action="store_const", const=2, help="Reduce dimensions of the test cases (unchecked)")
 
+    parser.add_argument("--work-size-jobs", dest="work_size_jobs", metavar="NUM", type=int, default=1, help="Number of work sizes checked in parallel for the checked work size reduction")
+    parser.add_argument("--work-size-budget", type=int, default=64, help="Maximum number of interestingness tests per test case for the checked work size reduction")
     parser.add_argument("--reduce", action="store_true", help="Start reduction of the test cases")
+    parser.add_argument("--cluster", choices=["defer", "skip"], help="Cluster the interesting test cases by bug signature before reducing them and reduce one representative per cluster first; the others are reduced afterwards (defer) or not at all (skip, which drops distinct bugs whose signatures happen to match)")
     parser.add_argument("--test", action="store", choices=["wrong-code-bug", "ppcg"], default=None, help="Interestingness test that should be used")
     parser.add_argument("--modes", nargs="+", action="store", choices=["atomic_reductions", "atomics", "barriers", "divergence", "fake_divergence", "group_divergence", "inter_thread_comm", "vectors"], help="CLsmith modes")
     parser.add_argument("--output", help="Output directory")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     parser.add_argument("--log", help="Log completed test cases")
+    parser.add_argument("--dedup", action="store_true", help="Skip test cases whose tokens are identical to those of a previous test case (before and after preprocessing)")
+    parser.add_argument("--dedup-index", dest="dedup_index", metavar="FILE", help="SQLite index of the test cases seen so far which is shared between runs (implies --dedup, default: dedup.sqlite in the output directory)")
+    parser.add_argument("--corpus-db", dest="corpus_db", metavar="FILE", help="SQLite index with the content, modes, work sizes, verdict and reduction results of every test case")
+    parser.add_argument("--skip-if", dest="skip_if", nargs=2, action="append", metavar=("STAGE", "EXPR"), default=[], help="Skip a stage (all, check or reduce) of the test cases whose row in the corpus index satisfies the SQL expression EXPR")
+    parser.add_argument("--cache", action="store_true", help="Cache interestingness verdicts in the output directory")
+    parser.add_argument("--pch", action="store_true", help="Precompile the libclc header for the static checks")
+    parser.add_argument("--daemon", action="store_true", help="Serve the interestingness tests of a reduction from a persistent daemon")
+    parser.add_argument("--adaptive-stage-order", dest="adaptive_stage_order", action="store_true", help="Reorder the stages of the interestingness tests by their observed costs and rejection rates")
+    parser.add_argument("--trace", action="store_true", help="Trace the tool runs of the interestingness tests and report them per reduction")
+    parser.add_argument("--record", metavar="DIR", help="Record all tool runs of the interestingness tests in DIR")
+    parser.add_argument("--replay", metavar="DIR", help="Replay the tool runs recorded in DIR instead of running the tools")
+    parser.add_argument("--replay-timing", dest="replay_timing", choices=["original", "instant"], default="original", help="Whether replayed tool runs take their recorded time or finish instantly")
+    parser.add_argument("--adaptive-timeouts", dest="adaptive_timeouts", action="store_true", help="Derive the timeouts of the interestingness tests from the runtimes of the original test case")
 
     args = parser.parse_args()
 
@@ -104,6 +665,36 @@ if __name__ == "__main__":
     # Print invocation for logging purposes
     print("Command: {}".format(" ".join(sys.argv)), file=log_file)
 
+    # Split the cores between the parallel test cases and C-Reduce
+    if args.max_cores:
+        if args.n is None:
+            args.n = max(1, args.max_cores // args.jobs)
+
+        args.jobs = max(1, min(args.jobs, args.max_cores // args.n))
+
+    if args.generate_jobs is None:
+        args.generate_jobs = args.jobs
+
+    if args.cluster is not None and not (args.check and args.reduce):
+        print("--cluster requires --check and --reduce")
+        sys.exit(1)
+
+    if args.skip_if and args.corpus_db is None:
+        print("--skip-if requires --corpus-db")
+        sys.exit(1)
+
+    # Pool workers cannot start their own worker processes
+    if args.jobs > 1 and args.work_size_jobs > 1:
+        print("--work-size-jobs cannot be combined with --jobs")
+        sys.exit(1)
+
+    # Fail early instead of inside of a parallel job
+    if args.check or args.reduce_work_sizes == 1 or args.reduce:
+        get_test_class(args.test)
+
+    cl_smith_path = None
+    cl_smith_tool = None
+
     if args.generate or args.preprocess or not args.preprocessed:
         cl_smith_path = os.environ.get("CLSMITH_INCLUDE_PATH")
 
@@ -112,15 +703,16 @@ if __name__ == "__main__":
             sys.exit(1)
 
     if args.check or args.reduce_work_sizes == 1 or args.reduce:
-        if os.environ.get("CREDUCE_TEST_PLATFORM") is None:
+        if os.environ.get("CREDUCE_TEST_PLATFORM") is None and os.environ.get("CREDUCE_TEST_TARGETS") is None:
             print("CREDUCE_TEST_PLATFORM not defined!")
             sys.exit(1)
 
-        if os.environ.get("CREDUCE_TEST_DEVICE") is None:
+        if os.environ.get("CREDUCE_TEST_DEVICE") is None and os.environ.get("CREDUCE_TEST_TARGETS") is None:
             print("CREDUCE_TEST_DEVICE not defined!")
             sys.exit(1)
 
-    if args.check or args.reduce_work_sizes == 1 or args.reduce:
+    # Replayed reductions do not need any of the tools
+    if (args.check or args.reduce_work_sizes == 1 or args.reduce) and args.replay is None:
         cl_launcher = os.environ.get("CREDUCE_TEST_CL_LAUNCHER", os.path.abspath("./cl_launcher"))
 
         if which(cl_launcher) is None:
@@ -135,7 +727,7 @@ if __name__ == "__main__":
     if which(clang) is None:
         clang = os.path.basename(clang)
 
-        if which(clang) is None:
+        if which(clang) is None and args.replay is None:
             print("CREDUCE_TEST_CLANG not defined and clang not found!")
             sys.exit(1)
 
@@ -151,6 +743,48 @@ if __name__ == "__main__":
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
 
+    if args.dedup_index:
+        args.dedup_index = os.path.abspath(os.path.join(orig_dir, args.dedup_index))
+    elif args.dedup:
+        args.dedup_index = os.path.join(output_dir, "dedup.sqlite")
+
+    # Predicates of the same stage are alternatives
+    skip_if = {}
+
+    for (stage, predicate) in args.skip_if:
+        if stage not in ["all", "check", "reduce"]:
+            print("Invalid --skip-if stage: {}".format(stage))
+            sys.exit(1)
+
+        skip_if.setdefault(stage, []).append("({})".format(predicate))
+
+    args.skip_if = {stage: " OR ".join(predicates) for (stage, predicates) in skip_if.items()}
+
+    if args.corpus_db:
+        args.corpus_db = os.path.abspath(os.path.join(orig_dir, args.corpus_db))
+        corpus = corpus_index.CorpusIndex(args.corpus_db)
+
+        for predicate in args.skip_if.values():
+            try:
+                corpus.validate(predicate)
+            except sqlite3.Error as err:
+                print("Invalid --skip-if expression: {}".format(err))
+                sys.exit(1)
+
+    # Share verdicts between all interestingness tests
+    if args.cache:
+        os.environ["CREDUCE_TEST_CACHE"] = os.path.join(output_dir, "verdicts.sqlite")
+
+    if args.pch:
+        os.environ["CREDUCE_TEST_PCH_DIR"] = os.path.join(output_dir, "pch")
+
+    if args.record:
+        os.environ["CREDUCE_TEST_RECORD"] = os.path.abspath(os.path.join(orig_dir, args.record))
+
+    if args.replay:
+        os.environ["CREDUCE_TEST_REPLAY"] = os.path.abspath(os.path.join(orig_dir, args.replay))
+        os.environ["CREDUCE_TEST_REPLAY_TIMING"] = args.replay_timing
+
     # Get excluded files
     excluded_files = [];
 
@@ -192,182 +826,55 @@ if __name__ == "__main__":
         shutil.copy(os.path.join(cl_smith_path, "safe_math_macros.h"), ".")
         shutil.copy(os.path.join(cl_smith_path, "cl_safe_math_macros.h"), ".")
 
-    # Iterate over all test cases
-    for test_case in test_cases:
-        test_case_path = test_case
-        (test_case_name, _) = os.path.splitext(os.path.basename(test_case))
-
-        print(os.path.basename(test_case_path), end=" ", flush=True, file=log_file)
-
-        # Generate test case if desired
-        if args.generate:
-            try:
-                cmd = [cl_smith_tool]
-
-                if args.modes:
-                    cmd.extend(["--" + mode for mode in args.modes])
-
-                subprocess.run(cmd, timeout=60, check=True)
-            except subprocess.SubprocessError:
-                print("-> aborted generation", file=log_file)
-                continue
-
-            test_case_path = os.path.abspath("./{}.cl".format(test_case_name))
-            shutil.move("CLProg.c", test_case_path)
-
-            if args.verbose:
-                print("-> generated", end=" ", flush=True, file=log_file)
-
-        # Check if file exists
-        if not os.path.isfile(test_case_path):
-            print("-> not found", file=log_file)
-            continue
-
-        # Preprocess test case if desired
-        if args.preprocess:
-            try:
-                cmd = [clang]
-                cmd.extend(["-I", cl_smith_path, "-E", "-CC", "-o", "{}.pre.cl".format(test_case_name), test_case_path])
-                subprocess.run(cmd, timeout=60, check=True)
-                remove_preprocessor_comments("{}.pre.cl".format(test_case_name))
-                test_case_path = os.path.abspath("{}.pre.cl".format(test_case_name))
-
-                if args.verbose:
-                    print("-> preprocessed", end=" ", flush=True, file=log_file)
-            except subprocess.SubprocessError:
-                print("-> aborted preprocessing", file=log_file)
-                continue
-
-        # Reduce work sizes of the test case
-        if args.reduce_work_sizes:
-            shutil.copy(test_case_path, "{}.rws.cl".format(test_case_name))
-            test_case_path = os.path.abspath("{}.rws.cl".format(test_case_name))
-
-            if args.reduce_work_sizes == 1:
-                test_class = get_test_class(args.test)
-                options = test_class.get_test_options(os.environ)
-                test = test_class([test_case_path], options)
-            else:
-                test = None
-
-            reducer = work_size_reduction.WorkSizeReducer(test_case_path, test)
-            success = reducer.run(checked=(args.reduce_work_sizes == 1))
+    config = {"cl_smith_path": cl_smith_path, "clang": clang}
+    scratch_root = tempfile.mkdtemp(prefix="scratch.", dir=output_dir)
 
-            if args.verbose:
-                if success:
-                    print("-> work sizes reduced", end=" ", flush=True, file=log_file)
-                else:
-                    print("-> work sizes unchanged", end=" ", flush=True, file=log_file)
-
-        # Check if test case is interesting
-        if args.check:
-            test_class = get_test_class(args.test)
-            myenv = os.environ
-            myenv['CREDUCE_PPCG_HOST_EXEC_DIR'] = os.path.dirname(test_case_path)
-            options = test_class.get_test_options(myenv)
-            tmp_dir = tempfile.mkdtemp()
-            out_dir = os.getcwd()
-            os.chdir(tmp_dir)
-            test_case_file = os.path.basename(test_case_path)
-
-            shutil.copy(test_case_path, test_case_file)
-            test = test_class([test_case_file], options)
-
-            try:
-                stop = False
-                result = test.check()
-
-                if not result:
-                    print("-> same output", file=log_file)
-                    stop = True
-            except interestingness_tests.TestTimeoutError as err:
-                print("-> timeout ({})".format(err), file=log_file)
-                stop = True
-            except interestingness_tests.InvalidTestCaseError as err:
-                print("-> failure ({})".format(err), file=log_file)
-                stop = True
-            finally:
-                os.chdir(out_dir)
-
-                try:
-                    shutil.rmtree(tmp_dir)
-                except OSError:
-                    pass
-
-            if stop:
-                continue
-            else:
-                shutil.copy(test_case_path, "{}.chk.cl".format(test_case_name))
-                test_case_path = os.path.abspath("{}.chk.cl".format(test_case_name))
-                print("-> different output", end=" ", flush=True, file=log_file)
-
-        if args.reduce:
-            shutil.copy(test_case_path, "{}.cl".format(test_case_name))
-            host_exec_dir = os.path.dirname(test_case_path)
-            test_case_path = os.path.abspath("{}.cl".format(test_case_name))
-
-            reduction_env = os.environ
-            reduction_env['CREDUCE_PPCG_HOST_EXEC_DIR'] = host_exec_dir
-            reduction_env["CREDUCE_TEST_CASE"] = os.path.basename(test_case_path)
+    # Generated test cases are streamed into the remaining stages
+    if args.generate:
+        jobs = generate_test_cases(test_cases, args, cl_smith_tool, scratch_root)
+    else:
+        jobs = ((test_case, None, None) for test_case in test_cases)
 
-            test_script_file = get_test_script_file(args.test)
+    # Test cases which are still to be reduced after clustering
+    records = []
 
-            # Create test case wrapper
-            #FIXME: Call python script directly?
-            if sys.platform == "win32":
-                test_wrapper = "test_wrapper.bat"
+    # Iterate over all test cases
+    if args.jobs > 1:
+        # Enough jobs are submitted ahead to keep the workers busy while the
+        # results are consumed in order
+        submitted = threading.Semaphore(2 * args.jobs)
 
-                with open(test_wrapper, "w") as test_file:
-                    test_file.write("python {}\n".format(test_script_file))
+        with multiprocessing.Pool(args.jobs, initializer=init_job, initargs=(args, config, scratch_root)) as pool:
+            for (log, record) in pool.imap(run_job, get_bounded_jobs(jobs, submitted)):
+                submitted.release()
+                print(log, end="", flush=True, file=log_file)
 
-                os.chmod(test_wrapper, 0o744)
-            else:
-                test_wrapper = "test_wrapper.sh"
+                if record is not None:
+                    records.append(record)
 
-                with open(test_wrapper, "w") as test_file:
-                    test_file.write("#!/bin/bash\n")
-                    test_file.write("exec python3 {}\n".format(test_script_file))
+            if args.cluster is not None:
+                clusters = bug_signature.get_clusters(records)
+                bug_signature.write_clusters("clusters.json", clusters)
 
-                os.chmod(test_wrapper, 0o744)
-
-            cmd = ["perl"]
-            cmd.extend(["--", which("creduce")])
+                for log in pool.imap(run_reduce_job, get_reduction_order(clusters, args, log_file)):
+                    print(log, end="", flush=True, file=log_file)
+    else:
+        config["scratch_dir"] = output_dir
 
-            if args.n:
-                cmd.extend(["--n", str(args.n)])
+        for (test_case, seed, generated) in jobs:
+            record = process_test_case(test_case, seed, generated, args, config, log_file)
 
-            if args.verbose:
-                cmd.append("--debug")
+            if record is not None:
+                records.append(record)
 
-            cmd.append("--timing")
-            cmd.append(test_wrapper)
-            cmd.append(test_case_path)
+        if args.cluster is not None:
+            clusters = bug_signature.get_clusters(records)
+            bug_signature.write_clusters("clusters.json", clusters)
 
-            with open("{}.log".format(test_case_name), mode="w") as log:
-                try:
-                    stop = False
-                    size_before = os.path.getsize(test_case_path)
-                    start = time.monotonic()
-                    proc = subprocess.run(cmd, env=reduction_env, stdout=log, stderr=subprocess.STDOUT, universal_newlines=True)
-                except subprocess.SubprocessError:
-                    print("-> reduction aborted", file=log_file)
-                    stop = True
-                finally:
-                    log.write("\nRuntime: {} seconds\n".format(round(time.monotonic() - start, 0)))
-
-                    if size_before == os.path.getsize(test_case_path):
-                        try:
-                            os.remove(test_case_path)
-                        except OSError:
-                            pass
-
-            if stop:
-                continue
-            else:
-                if args.verbose:
-                    print("-> reduced", file=log_file)
+            for (record, cluster_id) in get_reduction_order(clusters, args, log_file):
+                reduce_clustered_test_case(record, cluster_id, args, config, log_file)
 
-        print("-> done", file=log_file)
+    shutil.rmtree(scratch_root, ignore_errors=True)
 
     os.chdir(orig_dir)
 
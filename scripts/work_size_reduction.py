@@ -1,56 +1,196 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import interestingness_tests
+import os
 import re
+import shutil
+import tempfile
+
+def check_work_sizes(test_class, options, test_case):
+    # Runs in a worker process, PPCG host programs expect the kernel in the
+    # current directory
+    os.chdir(os.path.dirname(test_case))
+
+    try:
+        return test_class([test_case], options).check()
+    except (interestingness_tests.TestTimeoutError, interestingness_tests.InvalidTestCaseError):
+        return False
 
 class WorkSizeReducer:
-    def __init__(self, test_case, test):
+    def __init__(self, test_case, test_class=None, options=None, budget=64, jobs=1):
+        self.test_case_path = os.path.abspath(test_case)
         self.test_case = open(test_case, "r+")
-        self.test = test
+        self.test_class = test_class
+        self.options = options
+        self.budget = budget
+        self.jobs = jobs
+        self.executor = None
+        self.scratch_dirs = []
+        self.evaluations = 0
+        self.memo = {}
         test_case_content = self.test_case.read()
 
         work_sizes_match = re.search(r"//(.*) -g ([0-9]+),([0-9]+),([0-9]+) -l ([0-9]+),([0-9]+),([0-9]+)\n", test_case_content)
 
         if work_sizes_match is not None:
             self.meta_information = work_sizes_match.group(1)
-            self.orig_global_work_size = (work_sizes_match.group(2), work_sizes_match.group(3), work_sizes_match.group(4))
-            self.orig_local_work_size = (work_sizes_match.group(5), work_sizes_match.group(6), work_sizes_match.group(7))
+            self.orig_global_work_size = tuple(int(work_sizes_match.group(i)) for i in range(2, 5))
+            self.orig_local_work_size = tuple(int(work_sizes_match.group(i)) for i in range(5, 8))
             self.test_case_content = test_case_content.replace(work_sizes_match.group(0), "")
+        else:
+            self.meta_information = None
 
     def __del__(self):
         self.test_case.close()
 
+    def __write_work_sizes(self, test_case, global_work_size, local_work_size):
+        test_case.write("//{0} -g {1[0]},{1[1]},{1[2]} -l {2[0]},{2[1]},{2[2]}\n".format(self.meta_information, global_work_size, local_work_size))
+        test_case.write(self.test_case_content)
+
     def __rewrite_work_sizes(self, global_work_size, local_work_size):
         self.test_case.seek(0)
         self.test_case.truncate()
-        self.test_case.write("//{0} -g {1[0]},{1[1]},{1[2]} -l {2[0]},{2[1]},{2[2]}\n".format(self.meta_information, global_work_size, local_work_size))
-        self.test_case.write(self.test_case_content)
+        self.__write_work_sizes(self.test_case, global_work_size, local_work_size)
         self.test_case.flush()
 
-    def __update_work_sizes(global_work_size, local_work_size):
-        #FIXME: Come up with a better algorithm
-        local_work_size = [s + 1 for s in local_work_size]
+    @staticmethod
+    def __get_global_work_size_pairs(orig_global_size, orig_local_size):
+        # Every global size not larger than the original one together with the
+        # largest valid local size
+        pairs = []
+
+        for global_size in range(1, orig_global_size + 1):
+            local_size = max(l for l in range(1, min(global_size, orig_local_size) + 1) if global_size % l == 0)
+            pairs.append((global_size, local_size))
+
+        return pairs
+
+    @staticmethod
+    def __get_local_work_size_pairs(global_size, orig_local_size):
+        return [(global_size, l) for l in range(1, min(global_size, orig_local_size) + 1) if global_size % l == 0]
+
+    def __search(self, global_work_size, local_work_size, dimension, pairs):
+        # K-ary search with one candidate per job. The last pair is assumed to
+        # be interesting.
+        low = 0
+        high = len(pairs) - 1
+
+        while low < high:
+            points = sorted(set(low + (high - low) * (i + 1) // (self.jobs + 1) for i in range(self.jobs)))
+            candidates = []
+
+            for point in points:
+                new_global_work_size = list(global_work_size)
+                new_local_work_size = list(local_work_size)
+                (new_global_work_size[dimension], new_local_work_size[dimension]) = pairs[point]
+                candidates.append((new_global_work_size, new_local_work_size))
+
+            results = self.__are_interesting(candidates)
+
+            if any(results):
+                i = results.index(True)
+                high = points[i]
+
+                if i > 0:
+                    low = points[i - 1] + 1
+            else:
+                low = points[-1] + 1
+
+        return pairs[high]
+
+    def __check(self, candidates):
+        if self.executor is None:
+            results = []
+
+            for (global_work_size, local_work_size) in candidates:
+                self.__rewrite_work_sizes(global_work_size, local_work_size)
+                test = self.test_class([self.test_case_path], self.options)
+
+                try:
+                    results.append(test.check())
+                except (interestingness_tests.TestTimeoutError, interestingness_tests.InvalidTestCaseError):
+                    results.append(False)
+
+            return results
 
-        for i in range(0, len(global_work_size)):
-            while global_work_size[i] % local_work_size[i] != 0:
-                global_work_size[i] += 1
+        # Every candidate gets its own copy of the test case in a separate
+        # scratch directory
+        futures = []
 
-        return (global_work_size, local_work_size)
+        for (i, (global_work_size, local_work_size)) in enumerate(candidates):
+            test_case = os.path.join(self.scratch_dirs[i], os.path.basename(self.test_case_path))
+
+            with open(test_case, "w") as test_file:
+                self.__write_work_sizes(test_file, global_work_size, local_work_size)
+
+            futures.append(self.executor.submit(check_work_sizes, self.test_class, self.options, test_case))
+
+        return [f.result() for f in futures]
+
+    def __are_interesting(self, candidates):
+        keys = [(tuple(g), tuple(l)) for (g, l) in candidates]
+        unknown = []
+
+        for key in keys:
+            # Keep the current best work sizes once the budget is exhausted
+            if key not in self.memo and key not in unknown and self.evaluations + len(unknown) < self.budget:
+                unknown.append(key)
+
+        self.evaluations += len(unknown)
+
+        for (key, result) in zip(unknown, self.__check(unknown)):
+            self.memo[key] = result
+
+        return [self.memo.get(key, False) for key in keys]
+
+    def __is_interesting(self, global_work_size, local_work_size):
+        return self.__are_interesting([(global_work_size, local_work_size)])[0]
 
     def run(self, checked):
+        if self.meta_information is None:
+            return False
+
+        if checked == False:
+            self.__rewrite_work_sizes([1] * len(self.orig_global_work_size), [1] * len(self.orig_local_work_size))
+            return True
+
+        if self.jobs > 1:
+            scratch_root = tempfile.mkdtemp(prefix="rws.", dir=os.path.dirname(self.test_case_path))
+            self.scratch_dirs = [tempfile.mkdtemp(dir=scratch_root) for _ in range(self.jobs)]
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs)
+
+        try:
+            return self.__run()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+                shutil.rmtree(scratch_root)
+
+    def __run(self):
         new_global_work_size = [1] * len(self.orig_global_work_size)
         new_local_work_size = [1] * len(self.orig_local_work_size)
 
-        if checked == False:
+        # Often the bug is still present with a single work item
+        if self.__is_interesting(new_global_work_size, new_local_work_size):
             self.__rewrite_work_sizes(new_global_work_size, new_local_work_size)
             return True
 
-        while not self.test.check():
-            (new_global_work_size, new_local_work_size) = self.__update_work_sizes(new_global_work_size, new_local_work_size)
+        new_global_work_size = list(self.orig_global_work_size)
+        new_local_work_size = list(self.orig_local_work_size)
+
+        # Search each dimension separately while the others are fixed, first
+        # the global and then the local size. The original work sizes are
+        # assumed to be interesting.
+        for i in range(0, len(new_global_work_size)):
+            pairs = self.__get_global_work_size_pairs(self.orig_global_work_size[i], self.orig_local_work_size[i])
+            (new_global_work_size[i], new_local_work_size[i]) = self.__search(new_global_work_size, new_local_work_size, i, pairs)
 
-            if (new_global_work_size == self.orig_global_work_size and
-                new_local_work_size == self.orig_local_work_size):
-                return False
+            pairs = self.__get_local_work_size_pairs(new_global_work_size[i], new_local_work_size[i])
+            (new_global_work_size[i], new_local_work_size[i]) = self.__search(new_global_work_size, new_local_work_size, i, pairs)
 
         self.__rewrite_work_sizes(new_global_work_size, new_local_work_size)
 
-        return True
+        return (tuple(new_global_work_size) != self.orig_global_work_size or
+                tuple(new_local_work_size) != self.orig_local_work_size)